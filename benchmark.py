@@ -0,0 +1,214 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+from utils import *
+from feature_extraction import *
+from train_models import get_model_scores
+from sklearn.model_selection import StratifiedKFold
+
+SKILLS = [
+    "Python", "SQL", "Java", "Machine Learning", "Data Analysis", "C++", "Microsoft Office",
+    "Project Management", "Git", "Linux", "Deep Learning", "JavaScript", "Excel", "Agile",
+]
+LANGUAGES = ["English", "Turkish", "German", "French", "Spanish", "Russian", "Arabic", "Italian", "Japanese"]
+PROFICIENCIES = ["elementary", "limited_working", "professional_working", "full_professional", "native_or_bilingual"]
+SCHOOLS = ["Boğaziçi Üniversitesi", "Orta Doğu Teknik Üniversitesi", "İstanbul Teknik Üniversitesi", "Bilkent University", "Koç University"]
+DEGREES = ["Bachelor", "Master", "Lisans", "Yüksek Lisans", "PhD", "Bachelor's degree", "Lise", "Ön Lisans"]
+STUDIES = ["Computer Engineering", "Industrial Engineering", "Economics", "Business Administration", "Mathematics", "Statistics"]
+LOCATIONS = [
+    "Istanbul, Turkey", "Ankara, Türkiye", "İzmir, Turkey", "Kahraman Maras, Turkey", "Şanliurfa", "İçel, Turkey",
+    "Afyon", "Kocaeli, Türkiye", "Turkey", "Berlin, Germany", "Bursa", "London, United Kingdom", None,
+]
+
+def zipf_choice(rng, values: list, size: int, extra: int = 0) -> np.ndarray:
+
+    # long tailed vocabularies like the real skill and school columns
+    values = values + [f"{values[0]} {i}" for i in range(extra)]
+    p = 1 / np.arange(1, len(values) + 1)
+
+    return rng.choice(np.array(values, dtype=object), size, p=p / p.sum())
+
+def generate_data(directory: str, n_rows: int = 10_000, seed: int = 0, chunksize: int = 1_000_000) -> dict:
+
+    # n_rows is the size of the largest table, users and the smaller tables scale with it
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_users = max(n_rows // 10, 10)
+    tables = {
+        "skills": (n_rows, lambda n: {
+            "user_id": rng.integers(0, n_users, n),
+            "skill": zipf_choice(rng, SKILLS, n, extra=500),
+        }),
+        "languages": (max(n_rows // 7, 1), lambda n: {
+            "user_id": rng.integers(0, n_users, n),
+            "language": zipf_choice(rng, LANGUAGES, n),
+            "proficiency": np.where(rng.random(n) < 0.1, None, rng.choice(PROFICIENCIES, n)),
+        }),
+        "education": (max(n_rows // 5, 1), lambda n: {
+            "user_id": rng.integers(0, n_users, n),
+            "school_name": zipf_choice(rng, SCHOOLS, n, extra=200),
+            "degree": np.where(rng.random(n) < 0.1, None, zipf_choice(rng, DEGREES, n)),
+            "fields_of_study": np.where(rng.random(n) < 0.1, None, zipf_choice(rng, STUDIES, n, extra=100)),
+        }),
+        "work_experiences": (max(n_rows // 2, 1), lambda n: {
+            "user_id": rng.integers(0, n_users, n),
+            "company_id": rng.integers(0, max(n_users // 2, 1), n),
+            "location": zipf_choice(rng, LOCATIONS, n),
+            "start_year_month": rng.integers(1995, 2020, n) * 100 + rng.integers(1, 13, n),
+        }),
+    }
+
+    paths = dict()
+    for name, (size, make) in tables.items():
+        paths[name] = os.path.join(directory, f"{name}.csv")
+        for start in range(0, size, chunksize):
+            pd.DataFrame(make(min(chunksize, size - start))).to_csv(
+                paths[name], mode="w" if start == 0 else "a", header=start == 0, index=False
+            )
+    paths["users"] = n_users
+
+    return paths
+
+def indicator_loop(df_: pd.DataFrame, feature: str, values: list, prefix: str = None) -> pd.DataFrame:
+
+    # the per-value .apply loop count_indicators replaced, kept as the baseline it is measured against
+    prefix = feature if prefix is None else prefix
+    df_ = df_[["user_id", feature]].copy()
+    for value in values:
+        df_[f"{prefix}_{value}"] = df_[feature].apply(lambda x: 1 if value == x else 0)
+
+    return df_.drop(columns=[feature]).groupby(by=["user_id"], as_index=False).sum()
+
+def measure(func, *args, repeat: int = 1, memory: bool = True, **kwargs) -> dict:
+
+    # timing runs go without tracemalloc, it slows allocation heavy code down
+    times = list()
+    for _ in range(repeat):
+        start, cpu = time.perf_counter(), time.process_time()
+        result = func(*args, **kwargs)
+        times.append((time.perf_counter() - start, time.process_time() - cpu))
+    stats = {"seconds": min(t[0] for t in times), "cpu_seconds": min(t[1] for t in times)}
+
+    if memory:
+        tracemalloc.start()
+        func(*args, **kwargs)
+        stats["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    stats["rows"] = len(result) if hasattr(result, "__len__") else None
+
+    return stats
+
+def model_inputs(paths: dict, seed: int = 0) -> tuple:
+
+    df = pd.DataFrame({"user_id": np.arange(paths["users"])})
+    df = df.merge(load_skills(paths["skills"], 50), on="user_id", how="left")
+    df = df.merge(load_work_experiences(paths["work_experiences"]).drop(columns=["company_id"]), on="user_id", how="left")
+    df["moved_after_2019"] = np.random.default_rng(seed).integers(0, 2, df.shape[0])
+    df = df.drop(columns=["user_id"])
+    n_test = df.shape[0] // 5
+
+    return df.iloc[n_test:], df.iloc[:n_test]
+
+def train_small(model, train_set: pd.DataFrame, test_set: pd.DataFrame, directory: str):
+
+    with PlotQueue(directory) as plots, contextlib.redirect_stdout(io.StringIO()):
+        return get_model_scores(
+            model, StratifiedKFold(3, shuffle=True, random_state=0), train_set, test_set, "moved_after_2019", 3, plots=plots
+        )
+
+def benchmarks(paths: dict, directory: str, only: list = None) -> dict:
+
+    locations = read_raw(paths["work_experiences"], ["location"])
+    skills = read_raw(paths["skills"], ["user_id", "skill"])
+    top_skills = skills["skill"].value_counts()[:50].keys().tolist()
+    cases = {
+        "load_skills": (load_skills, paths["skills"], 50),
+        "load_languages": (load_languages, paths["languages"], 8),
+        "load_school": (load_school, paths["education"], 50),
+        "load_degree": (load_degree, paths["education"], 18),
+        "load_study": (load_study, paths["education"], 55),
+        "load_education": (load_education, paths["education"], 50, True, 18, True, 55, False),
+        "load_work_experiences": (load_work_experiences, paths["work_experiences"]),
+        "load_skills_duckdb": (load_skills, paths["skills"], 50, True, False, None, "duckdb"),
+        "load_education_duckdb": (load_education, paths["education"], 50, True, 18, True, 55, False, False, None, "duckdb"),
+        "load_work_experiences_duckdb": (load_work_experiences, paths["work_experiences"], None, "duckdb"),
+        "count_indicators": (count_indicators, skills, "skill", top_skills),
+        "indicator_loop": (indicator_loop, skills, "skill", top_skills),
+        "fix_location": (fix_location, locations),
+        "add_populations": (add_populations, fix_location(locations)),
+        "add_employment": (add_employment, fix_location(locations)),
+    }
+    if not only or "get_model_scores" in only:
+        from xgboost import XGBClassifier
+        model = XGBClassifier(n_estimators=20, max_depth=4, tree_method="hist", enable_categorical=True, random_state=0)
+        cases["get_model_scores"] = (train_small, model, *model_inputs(paths), directory)
+
+    return {name: case for name, case in cases.items() if not only or name in only}
+
+def run(n_rows: int = 10_000, repeat: int = 1, memory: bool = True, only: list = None, seed: int = 0) -> dict:
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as directory:
+        paths = generate_data(directory, n_rows, seed)
+        results = dict()
+        for name, (func, *args) in benchmarks(paths, directory, only).items():
+            results[name] = measure(func, *args, repeat=repeat, memory=memory)
+            print(f"{name:<24}{results[name]['seconds']:>10.3f}s{results[name].get('peak_mb', float('nan')):>12.1f} MB")
+
+    return {
+        "n_rows": n_rows,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.2) -> list:
+
+    regressions = list()
+    for name, stats in report["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for metric in ("seconds", "peak_mb"):
+            old, new = baseline["results"][name].get(metric), stats.get(metric)
+            if not old or new is None:
+                continue
+            ratio = new / old
+            flag = "REGRESSION" if ratio > 1 + tolerance else ""
+            print(f"{name:<24}{metric:<10}{old:>10.3f}{new:>10.3f}{ratio:>8.2f}x {flag}")
+            if flag:
+                regressions.append((name, metric, ratio))
+
+    return regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Time the feature loaders, enrichment helpers and fold training on synthetic data.")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows in the largest synthetic table")
+    parser.add_argument("--repeat", type=int, default=1, help="timing runs per benchmark, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory run")
+    parser.add_argument("--only", nargs="*", help="benchmark names to run")
+    parser.add_argument("--save", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a regression is reported")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.repeat, not args.no_memory, args.only)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["n_rows"] != report["n_rows"]:
+            print(f"baseline was recorded with {baseline['n_rows']} rows, this run used {report['n_rows']}")
+        sys.exit(1 if compare(report, baseline, args.tolerance) else 0)
@@ -0,0 +1,94 @@
+import itertools
+import numpy as np
+
+def positive_scores(scores: list) -> np.ndarray:
+
+    # get_model_scores returns (n, 2) probability arrays, only the positive class is blended
+    return np.stack([np.asarray(s)[:, 1] if np.ndim(s) == 2 else np.asarray(s) for s in scores]).astype(np.float64)
+
+def weight_grid(n_models: int, step: float = 0.02, low: float = 0.02) -> np.ndarray:
+
+    # every weight vector on the simplex with the given step and a minimum weight per model
+    # rounded up so no weight falls below low, the inner round absorbs float noise like 0.07 / 0.01
+    units = int(round(1 / step))
+    low_units = int(np.ceil(round(low / step, 9)))
+    if n_models * low_units > units:
+        raise ValueError(f"{n_models} models with a minimum weight of {low} do not fit in steps of {step}")
+    grid = np.array(list(itertools.product(range(low_units, units + 1), repeat=n_models - 1)), dtype=int).reshape(-1, n_models - 1)
+    last = units - grid.sum(axis=1)
+    grid = np.column_stack([grid, last])[last >= low_units]
+
+    return grid * step
+
+def blend(scores: list, weights: np.ndarray) -> np.ndarray:
+    return np.atleast_2d(weights) @ positive_scores(scores)
+
+def grid_accuracy(y, scores: list, weights: np.ndarray, thresholds, batch_size: int = 2 ** 24) -> np.ndarray:
+
+    y = np.asarray(y).astype(bool)
+    weights = np.atleast_2d(weights)
+    thresholds = np.atleast_1d(thresholds).astype(np.float64)
+    probs = positive_scores(scores)
+    n, n_thr = y.shape[0], thresholds.shape[0]
+    order = np.argsort(thresholds, kind="stable")
+    ranked = thresholds[order]
+
+    accuracy = np.empty((weights.shape[0], n_thr))
+    n_weights = max(batch_size // n, 1)
+    for start in range(0, weights.shape[0], n_weights):
+        blended = weights[start:start + n_weights] @ probs
+        n_rows = blended.shape[0]
+
+        # bin = number of thresholds a score clears, row j of the grid predicts positive where bin > j
+        bins = np.searchsorted(ranked, blended, side="right") + (n_thr + 1) * np.arange(n_rows)[:, None]
+        positives = np.bincount(bins[:, y].ravel(), minlength=n_rows * (n_thr + 1)).reshape(n_rows, n_thr + 1)
+        negatives = np.bincount(bins[:, ~y].ravel(), minlength=n_rows * (n_thr + 1)).reshape(n_rows, n_thr + 1)
+        tp = np.cumsum(positives[:, ::-1], axis=1)[:, -2::-1]
+        fp = np.cumsum(negatives[:, ::-1], axis=1)[:, -2::-1]
+        accuracy[start:start + n_weights, order] = (tp + (~y).sum() - fp) / n
+
+    return accuracy
+
+def best_thresholds(y, blended: np.ndarray, batch_size: int = 2 ** 24) -> tuple:
+
+    y = np.asarray(y).astype(np.int64)
+    blended = np.atleast_2d(blended)
+    n = y.shape[0]
+    thresholds = np.empty(blended.shape[0])
+    accuracy = np.empty(blended.shape[0])
+    k = np.arange(n + 1)
+
+    n_weights = max(batch_size // (n + 1), 1)
+    for start in range(0, blended.shape[0], n_weights):
+        batch = blended[start:start + n_weights]
+        rows = np.arange(batch.shape[0])
+
+        # predicting the top k scores as positive: correct = tp(k) + negatives left out of the top k
+        order = np.argsort(-batch, axis=1)
+        ranked = np.take_along_axis(batch, order, axis=1)
+        tp = np.zeros((batch.shape[0], n + 1), dtype=np.int64)
+        np.cumsum(y[order], axis=1, out=tp[:, 1:])
+        correct = 2 * tp + (n - y.sum()) - k
+
+        # a cut is only reachable by a threshold where the score changes
+        correct[:, 1:n][ranked[:, :-1] == ranked[:, 1:]] = -1
+        best = correct.argmax(axis=1)
+
+        # score >= the lowest score kept positive reproduces the cut exactly
+        thresholds[start:start + n_weights] = np.where(best == 0, np.inf, ranked[rows, np.maximum(best - 1, 0)])
+        accuracy[start:start + n_weights] = correct[rows, best] / n
+
+    return thresholds, accuracy
+
+def search_blend(y, scores: list, weights: np.ndarray = None, thresholds=None, step: float = 0.02) -> dict:
+
+    weights = weight_grid(len(scores), step) if weights is None else np.atleast_2d(weights)
+    if thresholds is None:
+        thr, accuracy = best_thresholds(y, blend(scores, weights))
+    else:
+        thresholds = np.atleast_1d(thresholds)
+        grid = grid_accuracy(y, scores, weights, thresholds)
+        thr, accuracy = thresholds[grid.argmax(axis=1)], grid.max(axis=1)
+    best = accuracy.argmax()
+
+    return {"weights": weights[best], "threshold": thr[best], "accuracy": accuracy[best], "all_accuracy": accuracy}
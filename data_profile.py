@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+
+def hash_values(series: pd.Series) -> np.ndarray:
+
+    # numbers are hashed as floats so an int chunk and a float chunk of the same column agree
+    series = series.dropna()
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        series = series.astype("float64")
+
+    return np.unique(pd.util.hash_pandas_object(series, index=False).values)
+
+def missing_table(n_missing: pd.Series, n_rows: int) -> pd.DataFrame:
+
+    # same layout as the original check_missing
+    return pd.DataFrame(
+        {
+            "feature": n_missing.index,
+            "n_missing": n_missing.values,
+            "missing_ratio": n_missing.values / n_rows,
+        }
+    ).sort_values("n_missing", ascending=False)
+
+class DataProfile:
+
+    def __init__(self, sample: int = None, seed: int = 0, cardinality: bool = True, correlation: bool = True):
+        self.sample_size = sample
+        self.rng = np.random.default_rng(seed)
+        self.cardinality = cardinality
+        self.correlation = correlation
+        self.frame = None
+        self.n_rows = 0
+        self.columns = None
+        self.dtypes = None
+        self.n_missing = None
+        self.memory = None
+        self.hashes = dict()
+        self.numeric = None
+        self.shift = None
+        self.moments = None
+        self.sample = None
+        self.sample_keys = None
+        self.correlations = dict()
+
+    @classmethod
+    def from_frame(
+        cls, df_: pd.DataFrame, sample: int = None, seed: int = 0, cardinality: bool = True, correlation: bool = True
+    ) -> "DataProfile":
+
+        profile = cls(sample, seed, cardinality, correlation).update(df_)
+        # without sampling the frame itself is kept for rank correlations, not a copy of it
+        if sample is None:
+            profile.frame = df_
+
+        return profile
+
+    @classmethod
+    def from_chunks(
+        cls, chunks, sample: int = None, seed: int = 0, cardinality: bool = True, correlation: bool = True
+    ) -> "DataProfile":
+
+        profile = cls(sample, seed, cardinality, correlation)
+        for chunk in chunks:
+            profile.update(chunk)
+
+        return profile
+
+    def update(self, chunk: pd.DataFrame) -> "DataProfile":
+
+        if self.columns is None:
+            self.columns = chunk.columns
+            self.dtypes = chunk.dtypes
+            self.n_missing = pd.Series(0, index=self.columns)
+            self.memory = pd.Series(0, index=self.columns)
+            self.numeric = chunk.select_dtypes(include=["number", "bool"]).columns
+            # shifting by the first chunk's means keeps the raw moment sums well conditioned
+            self.shift = chunk[self.numeric].mean().fillna(0).values
+        chunk = chunk[self.columns]
+
+        self.n_rows += chunk.shape[0]
+        self.n_missing += chunk.isnull().sum()
+        self.memory += chunk.memory_usage(index=False, deep=True)
+        if self.cardinality:
+            for col in self.columns:
+                self.hashes[col] = np.union1d(self.hashes.get(col, np.empty(0, dtype=np.uint64)), hash_values(chunk[col]))
+
+        if self.correlation:
+            self.update_moments(chunk)
+
+        # uniform sample over every chunk seen: keep the rows with the smallest random keys
+        if self.sample_size is not None:
+            keys = self.rng.random(chunk.shape[0])
+            sample = pd.concat([self.sample, chunk[self.numeric]]) if self.sample is not None else chunk[self.numeric]
+            keys = keys if self.sample_keys is None else np.concatenate([self.sample_keys, keys])
+            keep = np.argsort(keys)[: self.sample_size]
+            self.sample, self.sample_keys = sample.iloc[keep], keys[keep]
+
+        self.correlations = dict()
+
+        return self
+
+    def update_moments(self, chunk: pd.DataFrame) -> None:
+
+        # pairwise complete moments: counts, sums and cross products over rows where both columns are present
+        values = chunk[self.numeric].to_numpy(dtype="float64", na_value=np.nan) - self.shift
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0)
+        present = present.astype("float64")
+        moments = {
+            "n": present.T @ present,
+            "x": values.T @ present,
+            "xx": (values ** 2).T @ present,
+            "xy": values.T @ values,
+        }
+        self.moments = moments if self.moments is None else {k: self.moments[k] + v for k, v in moments.items()}
+
+    @property
+    def summary(self) -> pd.DataFrame:
+
+        return pd.DataFrame(
+            {
+                "dtype": self.dtypes.astype(str),
+                "n_missing": self.n_missing,
+                "missing_ratio": self.n_missing / self.n_rows,
+                "memory_mb": self.memory / 2 ** 20,
+                "n_unique": pd.Series({col: self.hashes[col].shape[0] for col in self.hashes}, dtype="float64")
+                if self.cardinality
+                else np.nan,
+            }
+        ).rename_axis("feature")
+
+    def missing(self) -> pd.DataFrame:
+        return missing_table(self.n_missing, self.n_rows)
+
+    def corr(self, method: str = "pearson") -> pd.DataFrame:
+
+        assert method in ["pearson", "spearman"], "Invalid Correlation Method"
+        if method not in self.correlations:
+            self.correlations[method] = self.pearson() if method == "pearson" else self.spearman()
+
+        return self.correlations[method]
+
+    def pearson(self) -> pd.DataFrame:
+
+        if self.moments is None:
+            raise ValueError("profiled with correlation=False")
+        n, x, xx, xy = (self.moments[k] for k in ("n", "x", "xx", "xy"))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = n * xy - x * x.T
+            var = n * xx - x ** 2
+            matrix = cov / np.sqrt(var * var.T)
+        matrix = np.clip(np.where(n > 1, matrix, np.nan), -1, 1)
+
+        return pd.DataFrame(matrix, index=self.numeric, columns=self.numeric)
+
+    def spearman(self) -> pd.DataFrame:
+
+        # ranks need every row at once, so they come from the in-memory frame or, for chunks, the sample;
+        # a sample gives an estimate of the full table's correlation, not the exact value
+        rows = self.sample if self.sample is not None else None if self.frame is None else self.frame[self.numeric]
+        if rows is None:
+            raise ValueError("spearman correlation needs a sample, pass sample=... when profiling chunks")
+        matrix = DataProfile.from_frame(rows.rank(), cardinality=False).corr("pearson")
+
+        # like DataFrame.corr, a pair involving a column with nulls is re-ranked over the rows where both are present
+        values = rows.to_numpy(dtype="float64", na_value=np.nan)
+        present = ~np.isnan(values)
+        nulls = np.flatnonzero(~present.all(axis=0))
+        for i in nulls:
+            for j in range(values.shape[1]):
+                if j == i or (j in nulls and j < i):
+                    continue
+                both = present[:, i] & present[:, j]
+                ranks = rankdata(values[both][:, [i, j]], axis=0)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    value = np.corrcoef(ranks, rowvar=False)[0, 1] if both.sum() > 1 else np.nan
+                matrix.iloc[i, j] = matrix.iloc[j, i] = value
+
+        return matrix
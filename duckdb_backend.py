@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+from functools import reduce
+from scipy.sparse import diags
+from utils import table_format
+from feature_extraction import (
+    REFERENCE_DATE,
+    DegreeFeatures,
+    EducationFeatures,
+    SchoolFeatures,
+    SkillFeatures,
+    StudyFeatures,
+    TextFeatures,
+    WorkExperienceFeatures,
+    aggregate_by_user,
+    weighted_stats,
+)
+
+# the strings pd.read_csv reads as missing by default
+NA_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+# threads, memory_limit and temp_directory are passed to duckdb as is, None keeps its default;
+# past memory_limit the sorts, windows and group bys spill to temp_directory
+settings = {"threads": None, "memory_limit": None, "temp_directory": None}
+
+def configure(**kwargs) -> None:
+    settings.update(kwargs)
+
+def quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+def connect():
+
+    import duckdb
+
+    con = duckdb.connect()
+    for key, value in settings.items():
+        if value is not None:
+            con.execute(f"SET {key} = {quote(value)}")
+    # file order breaks ties in the pandas loaders, so the scans have to keep it
+    con.execute("SET preserve_insertion_order = true")
+
+    return con
+
+def register_source(con, path: str, columns: list, text_columns: list = ()) -> None:
+
+    # a view over the file with its row position, nothing is loaded until a query runs
+    fmt = table_format(path)
+    if fmt == "feather":
+        import pyarrow.feather
+
+        con.register("raw_source", pyarrow.feather.read_table(path, columns=columns, memory_map=True))
+        scan = "raw_source"
+    elif fmt == "parquet":
+        scan = f"read_parquet({quote(path)})"
+    else:
+        options = [f"nullstr = [{', '.join(map(quote, NA_VALUES))}]"]
+        if text_columns:
+            options.append("types = {" + ", ".join(f"{quote(col)}: 'VARCHAR'" for col in text_columns) + "}")
+        scan = f"read_csv({quote(path)}, header = true, {', '.join(options)})"
+    con.execute(
+        f"CREATE OR REPLACE VIEW source AS SELECT {', '.join(columns)}, row_number() OVER () - 1 AS row FROM {scan}"
+    )
+
+def text_value(part: TextFeatures) -> str:
+    return f"coalesce({part.feature}, '')" if isinstance(part, DegreeFeatures) else part.feature
+
+def text_rows(part: TextFeatures) -> str:
+
+    # the rows part.prepare keeps, skills and languages drop repeated rows over every column they read,
+    # so a user listing a language twice with different proficiencies still counts it twice
+    others = [col for col in part.columns if col not in ("user_id", part.feature)]
+    rows = f"SELECT {', '.join(['user_id', f'{text_value(part)} AS value'] + others)}, row FROM source"
+    if isinstance(part, SkillFeatures):
+        rows += " WHERE skill IS NOT NULL"
+    if part.deduplicate:
+        rows = f"SELECT user_id, value, min(row) AS row FROM ({rows}) GROUP BY {', '.join(['user_id', 'value'] + others)}"
+
+    return rows
+
+def fit_text(con, part: TextFeatures) -> TextFeatures:
+
+    # counts in order of first appearance, the same dict fit_chunks builds
+    counts = con.execute(
+        f"SELECT value, count(*) AS n FROM ({text_rows(part)}) WHERE value IS NOT NULL GROUP BY value ORDER BY min(row)"
+    ).df()
+
+    return part.fit_counts(dict(zip(counts["value"], counts["n"].astype(np.int64))))
+
+def transform_text(con, part: TextFeatures, sparse: bool) -> tuple:
+
+    # one row per (user, value) with its multiplicity, the vocabulary is applied to these instead of the raw rows
+    grouped = con.execute(
+        f"SELECT user_id, value, count(*) AS n FROM ({text_rows(part)}) GROUP BY user_id, value ORDER BY user_id, min(row)"
+    ).df()
+    grouped = grouped.rename(columns={"value": part.feature})
+    grouped["n"] = grouped["n"].astype(np.int64)
+
+    matrix, columns = part.row_features(grouped)
+    weights = diags(grouped["n"].values, dtype=matrix.dtype)
+    features = aggregate_by_user(weights @ matrix, grouped["user_id"], columns, sparse=sparse)
+
+    return features, grouped
+
+def text_total(part: TextFeatures, grouped: pd.DataFrame) -> pd.DataFrame:
+
+    name, agg = part.total
+    users = grouped.groupby(by="user_id")
+    if agg == "nunique":
+        total = users[part.feature].nunique()
+    else:
+        total = grouped["n"].where(grouped[part.feature].notnull(), 0).groupby(grouped["user_id"]).sum()
+
+    return total.rename(name).reset_index()
+
+def fit_transform_text(con, transformer: TextFeatures) -> pd.DataFrame:
+
+    fit_text(con, transformer)
+    features, grouped = transform_text(con, transformer, transformer.sparse)
+    if transformer.total is None:
+        return features
+
+    return features.merge(text_total(transformer, grouped), on=["user_id"], how="left")
+
+def fit_transform_education(con, transformer: EducationFeatures) -> pd.DataFrame:
+
+    transformer.parts_ = [
+        SchoolFeatures(transformer.school_size, transformer.school_exact_match),
+        DegreeFeatures(transformer.degree_size, transformer.degree_exact_match),
+        StudyFeatures(transformer.study_size, transformer.study_exact_match),
+    ]
+    blocks = list()
+    for part in transformer.parts_:
+        fit_text(con, part)
+        features, grouped = transform_text(con, part, transformer.sparse)
+        if part.total is not None:
+            features = features.merge(text_total(part, grouped), on=["user_id"], how="left")
+        blocks.append(features)
+
+    # every part groups the same users, in the column order of EducationFeatures.transform
+    return reduce(lambda left, right: left.merge(right, on=["user_id"], how="left"), blocks)
+
+WORK_EXPERIENCES = """
+WITH parsed AS (
+    SELECT user_id, company_id, make_date(start_year_month // 100, start_year_month % 100, 1) AS start_date, row
+    FROM source
+    WHERE start_year_month // 100 != 2019
+),
+experiences AS (
+    SELECT *
+    FROM parsed
+    QUALIFY row_number() OVER (PARTITION BY user_id, company_id ORDER BY start_date, row) = 1
+),
+ordered AS (
+    SELECT
+        *,
+        row_number() OVER (PARTITION BY user_id ORDER BY start_date, row) AS position,
+        date_diff('day', start_date, lead(start_date) OVER (PARTITION BY user_id ORDER BY start_date, row)) AS days_to_quit
+    FROM experiences
+)
+"""
+
+EMPLOYEES = WORK_EXPERIENCES + f"""
+SELECT
+    user_id,
+    date_diff('day', min(start_date), DATE '{REFERENCE_DATE.date()}') AS employee_lifetime,
+    date_diff('day', max(start_date), DATE '{REFERENCE_DATE.date()}') AS employee_last_experience,
+    date_diff('day', min(start_date), max(start_date)) AS employee_total_experience,
+    CAST(arg_max(days_to_quit, position) FILTER (WHERE days_to_quit IS NOT NULL) AS DOUBLE) AS employee_last_days_to_quit,
+    CAST(min(days_to_quit) AS DOUBLE) AS employee_min_days_to_quit,
+    CAST(max(days_to_quit) AS DOUBLE) AS employee_max_days_to_quit,
+    CAST(stddev_samp(days_to_quit) AS DOUBLE) AS employee_std_days_to_quit,
+    CAST(median(days_to_quit) AS DOUBLE) AS employee_med_days_to_quit,
+    CAST(month(max(start_date)) AS BIGINT) AS employee_last_experience_month,
+    CAST(year(max(start_date)) AS BIGINT) AS employee_last_experience_year,
+    CAST(year(min(start_date)) AS BIGINT) AS employee_first_experience_year,
+    count(DISTINCT company_id) AS employee_nunique_company,
+    arg_max(company_id, position) FILTER (WHERE company_id IS NOT NULL) AS company_id,
+    count(company_id) FILTER (WHERE year(start_date) = 2018) AS company_count_2018,
+    count(company_id) FILTER (WHERE year(start_date) = 2017) AS company_count_2017
+FROM ordered
+GROUP BY user_id
+ORDER BY user_id
+"""
+
+COMPANIES = WORK_EXPERIENCES + f"""
+SELECT
+    company_id,
+    count(DISTINCT user_id) AS company_nunique_employees,
+    date_diff('day', min(start_date), DATE '{REFERENCE_DATE.date()}') AS company_lifetime,
+    date_diff('day', max(start_date), DATE '{REFERENCE_DATE.date()}') AS company_last_hire
+FROM ordered
+WHERE company_id IS NOT NULL
+GROUP BY company_id
+ORDER BY company_id
+"""
+
+DAYS_TO_QUIT = WORK_EXPERIENCES + """
+SELECT company_id, CAST(days_to_quit AS DOUBLE) AS value, count(*) AS count
+FROM ordered
+WHERE company_id IS NOT NULL AND days_to_quit IS NOT NULL
+GROUP BY company_id, days_to_quit
+"""
+
+def fit_transform_work_experiences(con, transformer: WorkExperienceFeatures) -> pd.DataFrame:
+
+    employees = con.execute(EMPLOYEES).df()
+    months = employees["employee_last_experience_month"]
+    employees = employees.assign(
+        employee_avg_days_to_quit=employees.employee_lifetime / employees.employee_nunique_company,
+        employee_last_experience_month_sin=np.sin(2 * np.pi * months / 12),
+        employee_last_experience_month_cos=np.cos(2 * np.pi * months / 12),
+    )
+    # the year counts come last, like the merge in employee_features
+    employees = employees[[col for col in employees.columns if not col.startswith("company_count")] + ["company_count_2018", "company_count_2017"]]
+
+    # the moments come from (company, days, count) triples, a few rows per company instead of every experience
+    companies = con.execute(COMPANIES).df().set_index("company_id")
+    stats = weighted_stats(con.execute(DAYS_TO_QUIT).df().astype({"count": np.int64})).reindex(companies.index)
+    transformer.companies_ = pd.DataFrame(
+        {
+            "company_avg_days_to_quit": stats["mean"],
+            "company_std_days_to_quit": stats["std"],
+            "company_max_days_to_quit": stats["max"],
+            "company_med_days_to_quit": stats["median"],
+            "company_skew_days_to_quit": stats["skew"],
+            "company_nunique_employees": companies["company_nunique_employees"],
+            "company_lifetime": companies["company_lifetime"],
+            "company_last_hire": companies["company_last_hire"],
+        }
+    ).reset_index()
+
+    return transformer.combine(employees)
+
+def fit_transform(transformer, path: str) -> pd.DataFrame:
+
+    con = connect()
+    try:
+        if isinstance(transformer, WorkExperienceFeatures):
+            register_source(con, path, transformer.columns[:1] + ["company_id", "start_year_month"])
+            return fit_transform_work_experiences(con, transformer)
+        if isinstance(transformer, EducationFeatures):
+            register_source(con, path, transformer.columns, transformer.columns[1:])
+            return fit_transform_education(con, transformer)
+        register_source(con, path, transformer.columns, transformer.columns[1:])
+        return fit_transform_text(con, transformer)
+    finally:
+        con.close()
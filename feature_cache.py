@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import inspect
+import importlib
+import importlib.util
+import pandas as pd
+
+# bump by hand for output changes outside the loader's module and CODE_DEPENDENCIES, e.g. new reference data
+CACHE_VERSION = 1
+# modules the loaders call into (location normalization, text normalization, the duckdb queries),
+# an edit to any of them invalidates the cache like an edit to the loader itself
+CODE_DEPENDENCIES = ("utils", "text_normalization", "duckdb_backend")
+LIBRARIES = ("numpy", "pandas", "sklearn")
+FRAME_FORMATS = (("parquet", pd.read_parquet), ("pkl", pd.read_pickle))
+STAGING_PREFIX = ".staging-"
+# a staging directory older than this belongs to a write that died, not one still running
+STAGING_TIMEOUT = 3600
+
+def write_frame(df_: pd.DataFrame, stem: str) -> str:
+
+    # parquet has no sparse columns, those frames are pickled instead
+    if any(isinstance(dtype, pd.SparseDtype) for dtype in df_.dtypes):
+        df_.to_pickle(f"{stem}.pkl")
+        return f"{stem}.pkl"
+    df_.to_parquet(f"{stem}.parquet", index=False)
+
+    return f"{stem}.parquet"
+
+def read_frame(path: str) -> pd.DataFrame:
+    return dict(FRAME_FORMATS)[path.rsplit(".", 1)[-1]](path)
+
+class FeatureCache:
+
+    def __init__(self, directory: str = ".feature_cache", max_size: int = 2 * 1024 ** 3, hash_content: bool = False):
+        self.directory = directory
+        self.max_size = max_size
+        self.hash_content = hash_content
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, func, path: str, *args, **kwargs) -> pd.DataFrame:
+
+        params = inspect.signature(func).bind(path, *args, **kwargs)
+        params.apply_defaults()
+        params = {k: v for k, v in params.arguments.items() if k != "path"}
+        key = self.key(func, path, params)
+
+        df_ = self.read(key)
+        if df_ is None:
+            df_ = func(path, *args, **kwargs)
+            self.write(key, df_, {"func": func.__name__, "path": os.path.abspath(path), "params": params})
+            self.evict()
+
+        return df_
+
+    def key(self, func, path: str, params: dict) -> str:
+
+        stat = os.stat(path)
+        fingerprint = {
+            "func": f"{func.__module__}.{func.__qualname__}",
+            # unwrap so the @profiled loaders hash their own module, not instrumentation.py
+            "code": file_hash(inspect.getsourcefile(inspect.unwrap(func))),
+            "dependencies": {name: module_hash(name) for name in CODE_DEPENDENCIES},
+            "libraries": {name: library_version(name) for name in LIBRARIES},
+            "version": CACHE_VERSION,
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "data": file_hash(path) if self.hash_content else stat.st_mtime_ns,
+            "params": params,
+        }
+
+        return hashlib.sha1(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
+
+    def entry_path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}.{ext}")
+
+    def read(self, key: str) -> pd.DataFrame:
+
+        # the sidecar is written last, an entry without one is unfinished or damaged and counts as a miss
+        if not os.path.exists(self.entry_path(key, "json")):
+            return None
+        for ext, reader in FRAME_FORMATS:
+            entry = self.entry_path(key, ext)
+            if os.path.exists(entry):
+                # access time drives the LRU order, another process may evict the entry in between
+                try:
+                    os.utime(self.entry_path(key, "json"))
+                    return reader(entry)
+                except FileNotFoundError:
+                    return None
+
+        return None
+
+    def write(self, key: str, df_: pd.DataFrame, meta: dict) -> None:
+
+        # both files are written under a temporary directory and moved into place, data first,
+        # so an interrupted write never leaves a sidecar pointing at a partial frame
+        staging = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.directory)
+        try:
+            data = write_frame(df_, os.path.join(staging, key))
+            with open(os.path.join(staging, f"{key}.json"), "w") as f:
+                json.dump(dict(meta, created=time.time()), f, default=str)
+            os.replace(data, os.path.join(self.directory, os.path.basename(data)))
+            os.replace(os.path.join(staging, f"{key}.json"), self.entry_path(key, "json"))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def entries(self) -> list:
+
+        # the loader workers share the directory, an entry another process removes meanwhile is skipped
+        entries = list()
+        for file in os.listdir(self.directory):
+            if not file.endswith(".json"):
+                continue
+            key = file[:-5]
+            try:
+                with open(self.entry_path(key, "json")) as f:
+                    meta = json.load(f)
+                last_access = os.path.getmtime(self.entry_path(key, "json"))
+            except FileNotFoundError:
+                continue
+            meta.update(key=key, last_access=last_access, size=sum(file_size(self.entry_path(key, ext)) for ext in ("parquet", "pkl")))
+            entries.append(meta)
+
+        return sorted(entries, key=lambda x: x["last_access"])
+
+    def remove(self, key: str) -> None:
+
+        for ext in ("parquet", "pkl", "json"):
+            remove_file(self.entry_path(key, ext))
+
+    def remove_orphans(self) -> None:
+
+        # data files whose sidecar is gone and staging directories left by interrupted writes
+        now = time.time()
+        for file in os.listdir(self.directory):
+            path = os.path.join(self.directory, file)
+            if file.startswith(STAGING_PREFIX):
+                if now - file_mtime(path, now) > STAGING_TIMEOUT:
+                    shutil.rmtree(path, ignore_errors=True)
+            elif file.endswith((".parquet", ".pkl")) and not os.path.exists(self.entry_path(file.rsplit(".", 1)[0], "json")):
+                remove_file(path)
+
+    def evict(self) -> None:
+
+        self.remove_orphans()
+        entries = self.entries()
+        total = sum(e["size"] for e in entries)
+        for entry in entries[:-1]:
+            if total <= self.max_size:
+                break
+            self.remove(entry["key"])
+            total -= entry["size"]
+
+    def invalidate(self, func=None, path: str = None) -> int:
+
+        removed = 0
+        for entry in self.entries():
+            if func is not None and entry["func"] != func.__name__:
+                continue
+            if path is not None and entry["path"] != os.path.abspath(path):
+                continue
+            self.remove(entry["key"])
+            removed += 1
+
+        return removed
+
+    def clear(self) -> int:
+        return self.invalidate()
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def file_mtime(path: str, default: float) -> float:
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return default
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def module_hash(name: str) -> str:
+
+    spec = importlib.util.find_spec(name)
+
+    return file_hash(spec.origin) if spec is not None and spec.origin else None
+
+def library_version(name: str) -> str:
+    # CountVectorizer and the pandas aggregations can change behaviour between releases
+    return getattr(importlib.import_module(name), "__version__", None)
@@ -1,264 +1,494 @@
-import re
+import joblib
 import warnings
 from utils import *
+from instrumentation import profiled, stage
 import pandas as pd
-from tqdm import tqdm
+from scipy.sparse import csc_matrix, csr_matrix, hstack, vstack
+from sklearn.base import BaseEstimator, TransformerMixin, clone
 from sklearn.feature_extraction.text import CountVectorizer
-from nltk.corpus import stopwords
+from text_normalization import my_tokenizer, stop_words, transform_unique
 warnings.filterwarnings('ignore')
 
-def my_tokenizer(text):
-    return re.split("\\s+",text)
+REFERENCE_DATE = pd.Timestamp("2019-01-01")
 
-def load_skills(path: str, size: int = 50, exact_match: bool = True) -> pd.DataFrame:
+@profiled(name="aggregate")
+def aggregate_by_user(matrix, user_ids, columns: list, sparse: bool = False) -> pd.DataFrame:
 
-    df_ = pd.read_csv(path)
-    df_ = df_.drop_duplicates().dropna(subset=["skill"])
+    user_codes, users = pd.factorize(pd.Series(user_ids), sort=True)
+    rows = np.flatnonzero(user_codes >= 0)
+    indicator = csr_matrix(
+        (np.ones(len(rows), dtype=matrix.dtype), (user_codes[rows], rows)),
+        shape=(len(users), matrix.shape[0]),
+    )
+    counts = csr_matrix(indicator @ matrix)
 
-    if exact_match:
-        most_freq_skills = df_["skill"].value_counts()[:size].keys().tolist()
-        for skill in tqdm(most_freq_skills):
-            df_[f"skill_{skill}"] = df_["skill"].apply(lambda x: 1 if skill == x else 0)
+    if sparse:
+        features = pd.DataFrame.sparse.from_spmatrix(counts, columns=columns)
+    else:
+        features = pd.DataFrame(counts.toarray(), columns=columns)
+    features.insert(0, "user_id", users)
 
-        return (
-            df_.drop(columns=["skill"], axis=1)
-            .groupby(by=["user_id"], as_index=False)
-            .sum()
-            .merge(
-                df_.groupby(by="user_id", as_index=False).agg(
-                    total_skills=("skill", "nunique")
-                ),
-                on=["user_id"],
-                how="left",
-            )
-        )
+    return features
 
-    else:
-        vectorizer = CountVectorizer(
-            max_features=size,
-            stop_words=stopwords.words("english"),
-            ngram_range=(1, 3),
-            tokenizer=my_tokenizer,
-        )
+def count_indicators(
+    df_: pd.DataFrame, feature: str, values: list, prefix: str = None, sparse: bool = False
+) -> pd.DataFrame:
 
-        return (
-            pd.DataFrame(
-                vectorizer.fit_transform(df_["skill"]).toarray(),
-                columns=[f"skill_{str(f)}" for f in vectorizer.get_feature_names()],
-            )
-            .assign(user_id=df_["user_id"].tolist())
-            .groupby(by="user_id", as_index=False)
-            .sum()
-            .merge(
-                df_.groupby(by="user_id", as_index=False).agg(
-                    total_skills=("skill", "nunique")
-                ),
-                on=["user_id"],
-                how="left",
-            )
-        )
+    prefix = feature if prefix is None else prefix
 
-def load_languages(path: str, size: int = 8):
+    return aggregate_by_user(
+        one_hot(df_[feature], values), df_["user_id"], [f"{prefix}_{v}" for v in values], sparse=sparse
+    )
 
-    df_ = pd.read_csv(path)
-    df_ = df_.drop_duplicates()
+def one_hot(series: pd.Series, values: list) -> csr_matrix:
 
-    vectorizer = CountVectorizer(max_features=size, ngram_range=(1, 1))
+    value_codes = pd.Categorical(series, categories=values).codes
+    rows = np.flatnonzero(value_codes >= 0)
 
-    return (
-        pd.DataFrame(
-            vectorizer.fit_transform(df_["language"]).toarray(),
-            columns=[f"language_{str(f)}" for f in vectorizer.get_feature_names()],
-        )
-        .assign(user_id=lambda x: df_["user_id"].tolist())
-        .groupby(by="user_id", as_index=False)
-        .sum()
-        .merge(
-            df_.groupby(by="user_id", as_index=False).agg(
-                total_languages=("language", "nunique")
-            ),
-            on=["user_id"],
-            how="left",
-        )
+    return csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, value_codes[rows])),
+        shape=(len(series), len(values)),
     )
 
-def load_school(path: str, size: int = 20, exact_match: bool = True) -> pd.DataFrame:
+def update_counts(counts: dict, series: pd.Series) -> dict:
 
-    df_ = pd.read_csv(path)[['user_id', 'school_name']]
+    # keeps the order of first appearance, like value_counts(sort=False) on the full table
+    for value, count in series.value_counts(sort=False).items():
+        counts[value] = counts.get(value, 0) + count
 
-    if exact_match:
-        most_freq_schools = df_["school_name"].value_counts()[:size].keys().tolist()
-        for school in tqdm(most_freq_schools):
-            df_[f"school_name_{school}"] = df_["school_name"].apply(lambda x: 1 if school == x else 0)
+    return counts
 
-        return (
-            df_.drop(columns=["school_name"], axis=1)
-            .groupby(by=["user_id"], as_index=False)
-            .sum().merge(
-                df_.groupby(by="user_id", as_index=False).agg(
-                    total_education=("school_name", "count")
-                ),
-                on=["user_id"],
-                how="left",
-            )
-        )
-    
-    else:
-        vectorizer = CountVectorizer(
-            max_features=size,
-            stop_words=stopwords.words("english"),
+def unseen(hashes: np.ndarray, seen: set) -> np.ndarray:
+
+    # first occurrences of the hashes missing from seen, which is updated in place
+    new = ~pd.Series(hashes).duplicated().values
+    new[new] = np.fromiter((h not in seen for h in hashes[new].tolist()), bool, new.sum())
+    seen.update(hashes[new].tolist())
+
+    return new
+
+def fit_vectorizer(vectorizer: CountVectorizer, counts: pd.Series) -> CountVectorizer:
+
+    # same vocabulary as fitting on a corpus holding every document counts[document] times
+    full = clone(vectorizer).set_params(max_features=None)
+    matrix = full.fit_transform(counts.index)
+    terms = np.array(full.get_feature_names(), dtype=object)
+    kept = np.arange(len(terms))
+    if vectorizer.max_features is not None and len(terms) > vectorizer.max_features:
+        tfs = np.asarray(matrix.T @ counts.values).ravel()
+        kept = np.sort((-tfs).argsort()[:vectorizer.max_features])
+
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms[kept])}
+    vectorizer.stop_words_ = set(terms) - set(terms[kept])
+    vectorizer.fixed_vocabulary_ = False
+
+    return vectorizer
+
+def frame_to_csr(df_: pd.DataFrame) -> csr_matrix:
+
+    data, indices, indptr = list(), list(), [0]
+    for col in df_.columns:
+        values = df_[col].array
+        if isinstance(values, pd.arrays.SparseArray):
+            data.append(values.sp_values)
+            indices.append(values.sp_index.indices)
+        else:
+            data.append(np.asarray(values))
+            indices.append(np.arange(df_.shape[0]))
+        indptr.append(indptr[-1] + len(data[-1]))
+
+    return csc_matrix(
+        (np.concatenate(data), np.concatenate(indices), indptr), shape=df_.shape
+    ).tocsr()
+
+def add_by_user(total: pd.DataFrame, features: pd.DataFrame) -> pd.DataFrame:
+
+    if total is None:
+        return features
+
+    columns = features.columns.drop("user_id")
+    sparse_cols = [col for col in columns if isinstance(features[col].dtype, pd.SparseDtype)]
+    result = aggregate_by_user(
+        vstack([frame_to_csr(total[columns]), frame_to_csr(features[columns])]),
+        pd.concat([total["user_id"], features["user_id"]], ignore_index=True),
+        list(columns),
+        sparse=len(sparse_cols) > 0,
+    )
+    for col in columns.drop(sparse_cols):
+        result[col] = result[col].sparse.to_dense() if sparse_cols else result[col]
+
+    return result
+
+class TextFeatures(BaseEstimator, TransformerMixin):
+
+    feature = None
+    total = None
+    deduplicate = False
+
+    def __init__(self, size: int = 20, exact_match: bool = True, sparse: bool = False):
+        self.size = size
+        self.exact_match = exact_match
+        self.sparse = sparse
+
+    @property
+    def columns(self) -> list:
+        return ["user_id", self.feature]
+
+    def prepare(self, df_: pd.DataFrame) -> pd.DataFrame:
+        return df_[self.columns]
+
+    def top_values(self, counts: pd.Series) -> list:
+        return counts.sort_values(ascending=False)[:self.size].keys().tolist()
+
+    def make_vectorizer(self) -> CountVectorizer:
+        return CountVectorizer(
+            max_features=self.size,
+            stop_words=stop_words(),
             ngram_range=(1, 3),
         )
 
-        return (
-            pd.DataFrame(
-                vectorizer.fit_transform(df_["school_name"]).toarray(),
-                columns=[f"school_name_{str(f)}" for f in vectorizer.get_feature_names()],
-            )
-            .assign(user_id=df_["user_id"].tolist())
-            .groupby(by="user_id", as_index=False)
-            .sum()
-            .merge(
-                df_.groupby(by="user_id", as_index=False).agg(
-                    total_education=("school_name", "count")
-                ),
-                on=["user_id"],
-                how="left",
-            )
-        )
-        
-def load_degree(path: str, size: int = 20, exact_match: bool = True) -> pd.DataFrame:
+    def fit(self, df_: pd.DataFrame, y=None):
 
-    df_ = pd.read_csv(path)[['user_id', 'degree']].fillna('')
+        # the vocabulary is fitted on the distinct values weighted by their counts, not on every row
+        return self.fit_counts(self.prepare(df_)[self.feature].value_counts(sort=False))
 
-    if exact_match:
-        most_freq_degrees = df_.loc[df_['degree'] != '', 'degree'].value_counts()[:size].keys().tolist()
-        for degree in tqdm(most_freq_degrees):
-            df_[f"degree_{degree}"] = df_["degree"].apply(lambda x: 1 if degree == x else 0)
+    def stream(self, chunks):
 
-        return (
-            df_.drop(columns=["degree"], axis=1)
-            .groupby(by=["user_id"], as_index=False)
-            .sum()
-        )
-    
-    else:
-        vectorizer = CountVectorizer(
-            max_features=size,
-            stop_words=stopwords.words("english"),
-            ngram_range=(1, 2),
-        )
+        # skills and languages keep the 64-bit hash of every distinct row seen so far, so their memory is
+        # one chunk plus the hash set (about 100 bytes per distinct row), not the users alone
+        seen = set()
+        for chunk in chunks:
+            if self.deduplicate:
+                chunk = chunk.drop_duplicates()
+                chunk = chunk.loc[unseen(pd.util.hash_pandas_object(chunk, index=False).values, seen)]
 
-        return (
-            pd.DataFrame(
-                vectorizer.fit_transform(df_["degree"]).toarray(),
-                columns=[f"degree_{str(f)}" for f in vectorizer.get_feature_names()],
-            )
-            .assign(user_id=df_["user_id"].tolist())
-            .groupby(by="user_id", as_index=False)
-            .sum()
-        )
-        
-def load_study(path: str, size: int = 20, exact_match: bool = True) -> pd.DataFrame:
+            yield chunk
+
+    def fit_counts(self, counts: dict):
+
+        counts = pd.Series(counts, dtype=np.int64)
+        if self.exact_match:
+            self.values_ = self.top_values(counts)
+        else:
+            self.vectorizer_ = fit_vectorizer(self.make_vectorizer(), counts)
+
+        return self
 
-    df_ = pd.read_csv(path)[['user_id', 'fields_of_study']].fillna('')
+    def fit_chunks(self, chunks):
 
-    if exact_match:
-        most_freq_studies = df_.loc[df_['fields_of_study'] != '', 'fields_of_study'].value_counts()[:size].keys().tolist()
-        for study in tqdm(most_freq_studies):
-            df_[f"fields_of_study_{study}"] = df_["fields_of_study"].apply(lambda x: 1 if study == x else 0)
+        counts = dict()
+        for df_ in self.stream(chunks):
+            update_counts(counts, self.prepare(df_)[self.feature])
+
+        return self.fit_counts(counts)
+
+    def transform_chunks(self, chunks) -> pd.DataFrame:
+
+        # rows repeated across chunks are dropped in stream, so the value columns are additive;
+        # a nunique total only counts the (user, value) pairs no earlier chunk had, which needs its own
+        # hash set when the rows hold more than the pair (languages and their proficiency)
+        features, pairs = None, set()
+        count_pairs = self.total is not None and self.total[1] == "nunique" and len(self.columns) > 2
+        for df_ in self.stream(chunks):
+            df_ = self.prepare(df_)
+            chunk = self.user_features(df_)
+            if self.total is not None:
+                counted = self.first_pairs(df_, pairs) if count_pairs else df_
+                chunk = chunk.merge(self.totals(counted), on=["user_id"], how="left")
+            features = add_by_user(features, chunk)
+
+        return features
+
+    def first_pairs(self, df_: pd.DataFrame, pairs: set) -> pd.DataFrame:
+
+        new = unseen(pd.util.hash_pandas_object(df_[["user_id", self.feature]], index=False).values, pairs)
+
+        return df_.assign(**{self.feature: df_[self.feature].where(new)})
+
+    def fit_transform_chunks(self, read_chunks) -> pd.DataFrame:
+        return self.fit_chunks(read_chunks()).transform_chunks(read_chunks())
+
+    def row_features(self, df_: pd.DataFrame):
+
+        if self.exact_match:
+            return one_hot(df_[self.feature], self.values_), [f"{self.feature}_{v}" for v in self.values_]
 
         return (
-            df_.drop(columns=["fields_of_study"], axis=1)
-            .groupby(by=["user_id"], as_index=False)
-            .sum()
+            transform_unique(self.vectorizer_, df_[self.feature]),
+            [f"{self.feature}_{str(f)}" for f in self.vectorizer_.get_feature_names()],
         )
-    
-    else:
-        vectorizer = CountVectorizer(
-            max_features=size,
-            stop_words=stopwords.words("english"),
+
+    def user_features(self, df_: pd.DataFrame) -> pd.DataFrame:
+
+        matrix, columns = self.row_features(df_)
+
+        return aggregate_by_user(matrix, df_["user_id"], columns, sparse=self.sparse)
+
+    def totals(self, df_: pd.DataFrame) -> pd.DataFrame:
+
+        name, agg = self.total
+        with stage("groupby", df_) as current:
+            totals = df_.groupby(by="user_id", as_index=False).agg(**{name: (self.feature, agg)})
+            current.rows(totals)
+
+        return totals
+
+    def transform(self, df_: pd.DataFrame) -> pd.DataFrame:
+
+        df_ = self.prepare(df_)
+        features = self.user_features(df_)
+
+        if self.total is None:
+            return features
+
+        return features.merge(self.totals(df_), on=["user_id"], how="left")
+
+class SkillFeatures(TextFeatures):
+
+    feature = "skill"
+    total = ("total_skills", "nunique")
+    deduplicate = True
+
+    def __init__(self, size: int = 50, exact_match: bool = True, sparse: bool = False):
+        super().__init__(size, exact_match, sparse)
+
+    def prepare(self, df_: pd.DataFrame) -> pd.DataFrame:
+        return df_.drop_duplicates().dropna(subset=["skill"])[["user_id", "skill"]]
+
+    def make_vectorizer(self) -> CountVectorizer:
+        return CountVectorizer(
+            max_features=self.size,
+            stop_words=stop_words(),
             ngram_range=(1, 3),
+            tokenizer=my_tokenizer,
         )
 
-        return (
-            pd.DataFrame(
-                vectorizer.fit_transform(df_["fields_of_study"]).toarray(),
-                columns=[f"fields_of_study_{str(f)}" for f in vectorizer.get_feature_names()],
-            )
-            .assign(user_id=df_["user_id"].tolist())
-            .groupby(by="user_id", as_index=False)
-            .sum()
+class LanguageFeatures(TextFeatures):
+
+    feature = "language"
+    total = ("total_languages", "nunique")
+    deduplicate = True
+    exact_match = False
+
+    # repeated rows are dropped over the full row, the same language at two proficiencies counts twice
+    columns = ["user_id", "language", "proficiency"]
+
+    def __init__(self, size: int = 8, sparse: bool = False):
+        self.size = size
+        self.sparse = sparse
+
+    def prepare(self, df_: pd.DataFrame) -> pd.DataFrame:
+        return df_.drop_duplicates()[["user_id", "language"]]
+
+    def make_vectorizer(self) -> CountVectorizer:
+        return CountVectorizer(max_features=self.size, ngram_range=(1, 1))
+
+class SchoolFeatures(TextFeatures):
+
+    feature = "school_name"
+    total = ("total_education", "count")
+
+class DegreeFeatures(TextFeatures):
+
+    feature = "degree"
+
+    def prepare(self, df_: pd.DataFrame) -> pd.DataFrame:
+        return df_[["user_id", self.feature]].fillna("")
+
+    def top_values(self, counts: pd.Series) -> list:
+        return counts[counts.index != ""].sort_values(ascending=False)[:self.size].keys().tolist()
+
+    def make_vectorizer(self) -> CountVectorizer:
+        return CountVectorizer(
+            max_features=self.size,
+            stop_words=stop_words(),
+            ngram_range=(1, 2),
         )
 
-def load_work_experiences(path: str) -> pd.DataFrame:
+class StudyFeatures(DegreeFeatures):
 
-    df_ = pd.read_csv(path)
-    tr_cities = load_tr_cities()
-    df_["start_date"] = pd.to_datetime(
-        df_["start_year_month"].apply(lambda x: "-".join([str(x)[:4], str(x)[4:]]))
-    )
+    feature = "fields_of_study"
+
+    def make_vectorizer(self) -> CountVectorizer:
+        return TextFeatures.make_vectorizer(self)
+
+class EducationFeatures(BaseEstimator, TransformerMixin):
+
+    def __init__(
+        self,
+        school_size: int = 20,
+        school_exact_match: bool = True,
+        degree_size: int = 20,
+        degree_exact_match: bool = True,
+        study_size: int = 20,
+        study_exact_match: bool = True,
+        sparse: bool = False,
+    ):
+        self.school_size = school_size
+        self.school_exact_match = school_exact_match
+        self.degree_size = degree_size
+        self.degree_exact_match = degree_exact_match
+        self.study_size = study_size
+        self.study_exact_match = study_exact_match
+        self.sparse = sparse
+
+    @property
+    def columns(self) -> list:
+        return ["user_id", "school_name", "degree", "fields_of_study"]
+
+    def fit(self, df_: pd.DataFrame, y=None):
+
+        self.parts_ = [
+            SchoolFeatures(self.school_size, self.school_exact_match).fit(df_),
+            DegreeFeatures(self.degree_size, self.degree_exact_match).fit(df_),
+            StudyFeatures(self.study_size, self.study_exact_match).fit(df_),
+        ]
+
+        return self
+
+    def transform(self, df_: pd.DataFrame) -> pd.DataFrame:
+
+        # one grouped pass for the school, degree and study columns, in the order the separate loaders were merged
+        blocks, columns = list(), list()
+        for part in self.parts_:
+            matrix, part_columns = part.row_features(part.prepare(df_))
+            blocks.append(matrix)
+            columns += part_columns
+            if isinstance(part, SchoolFeatures):
+                blocks.append(csr_matrix(df_[["school_name"]].notnull().values.astype(np.int64)))
+                columns.append("total_education")
+
+        features = aggregate_by_user(hstack(blocks).tocsr(), df_["user_id"], columns, sparse=self.sparse)
+        if self.sparse:
+            features["total_education"] = features["total_education"].sparse.to_dense()
+
+        return features
+
+    def fit_chunks(self, chunks):
+
+        self.parts_ = [
+            SchoolFeatures(self.school_size, self.school_exact_match),
+            DegreeFeatures(self.degree_size, self.degree_exact_match),
+            StudyFeatures(self.study_size, self.study_exact_match),
+        ]
+        counts = [dict() for _ in self.parts_]
+        for chunk in chunks:
+            for part, part_counts in zip(self.parts_, counts):
+                update_counts(part_counts, part.prepare(chunk)[part.feature])
+        for part, part_counts in zip(self.parts_, counts):
+            part.fit_counts(part_counts)
+
+        return self
+
+    def transform_chunks(self, chunks) -> pd.DataFrame:
+
+        features = None
+        for chunk in chunks:
+            features = add_by_user(features, self.transform(chunk))
+
+        return features
+
+    def fit_transform_chunks(self, read_chunks) -> pd.DataFrame:
+        return self.fit_chunks(read_chunks()).transform_chunks(read_chunks())
+
+def parse_work_experiences(df_: pd.DataFrame) -> pd.DataFrame:
+
+    df_ = df_.copy()
+    df_["start_date"] = pd.to_datetime(df_["start_year_month"].astype(str), format="%Y%m")
     df_ = df_.drop(columns=["start_year_month"], axis=1)
-    df_.loc[
-        df_["location"].astype(str).str.contains("Kahraman Maras"), "location"
-    ] = "Kahramanmaras, Turkey"
-    df_.loc[
-        df_["location"].astype(str).str.contains("Şanliurfa"), "location"
-    ] = "Sanliurfa, Turkey"
-    df_.loc[
-        df_["location"].astype(str).str.contains("İçel"), "location"
-    ] = "Mersin, Turkey"
-    df_.loc[
-        df_["location"].astype(str).str.contains("Afyon"), "location"
-    ] = "Afyonkarahisar, Turkey"
-    df_["location"] = df_["location"].apply(
-        lambda x: str(x).replace("Türkiye", "Turkey")
-    )
-    df_["location"] = df_["location"].apply(lambda x: x.upper().strip())
-    df_["location"] = df_["location"].apply(lambda x: translation(str(x)))
-    for city in tr_cities:
-        df_["location"] = df_["location"].apply(lambda x: city if city in x else x)
-
-    df_ = (
-        df_.loc[df_["start_date"].dt.year != 2019]
-        .sort_values(by=["user_id", "start_date"])
-        .reset_index(drop=True)
-    )
+    df_["location"] = location_normalizer.normalize(df_["location"])
+
+    return df_.loc[df_["start_date"].dt.year != 2019]
+
+@profiled
+def order_work_experiences(df_: pd.DataFrame, by: list = ["user_id", "start_date"]) -> pd.DataFrame:
+
+    df_ = df_.sort_values(by=by).reset_index(drop=True)
     df_ = df_.drop_duplicates(subset=["user_id", "company_id"])
     df_["quit_date"] = df_.groupby("user_id")["start_date"].shift(-1)
-    df_["days_to_quit"] = (df_["quit_date"] - df_["start_date"]).apply(
-        lambda x: np.nan if str(x).split()[0] == "NaT" else int(str(x).split()[0])
+    df_["days_to_quit"] = (df_["quit_date"] - df_["start_date"]).dt.days
+
+    return df_
+
+def prepare_work_experiences(df_: pd.DataFrame) -> pd.DataFrame:
+    return order_work_experiences(parse_work_experiences(df_))
+
+def stream_work_experiences(chunks) -> pd.DataFrame:
+
+    # keeps the earliest experience per (user, company); the file position breaks ties like the stable in-memory sort.
+    # Each chunk only touches its own pairs: a dict maps the pair hash to a slot, the ids of a new pair are appended
+    # and the start date and position of a known one are overwritten when the chunk has an earlier experience.
+    # Memory is one chunk plus about 130 bytes per distinct (user, company) pair.
+    slots, users, companies = dict(), list(), list()
+    starts, rows = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    offset = 0
+    for chunk in chunks:
+        chunk = chunk.assign(row=np.arange(offset, offset + chunk.shape[0]))
+        offset += chunk.shape[0]
+        chunk = parse_work_experiences(chunk)[["user_id", "company_id", "start_date", "row"]]
+        with stage("dedup", chunk) as current:
+            chunk = chunk.sort_values(by=["start_date", "row"]).drop_duplicates(subset=["user_id", "company_id"])
+            keys = pd.util.hash_pandas_object(chunk[["user_id", "company_id"]], index=False).values
+            slot = np.fromiter((slots.get(key, -1) for key in keys.tolist()), np.int64, keys.shape[0])
+            new = slot < 0
+            slot[new] = np.arange(len(slots), len(slots) + new.sum())
+            slots.update(zip(keys[new].tolist(), slot[new].tolist()))
+            users.append(chunk["user_id"].values[new])
+            companies.append(chunk["company_id"].values[new])
+
+            if len(slots) > starts.shape[0]:
+                size = max(2 * starts.shape[0], len(slots))
+                starts = np.concatenate([starts, np.empty(size - starts.shape[0], dtype=np.int64)])
+                rows = np.concatenate([rows, np.empty(size - rows.shape[0], dtype=np.int64)])
+            start = chunk["start_date"].values.astype("datetime64[ns]").view(np.int64)
+            # positions only grow, so a known pair is replaced by a strictly earlier start date alone
+            earlier = new.copy()
+            earlier[~new] = start[~new] < starts[slot[~new]]
+            starts[slot[earlier]] = start[earlier]
+            rows[slot[earlier]] = chunk["row"].values[earlier]
+            current.rows(chunk)
+
+    state = pd.DataFrame(
+        {
+            "user_id": np.concatenate(users),
+            "company_id": np.concatenate(companies),
+            "start_date": starts[:len(slots)].view("datetime64[ns]"),
+            "row": rows[:len(slots)],
+        }
     )
 
-    emp_df = (
-        df_.groupby(by="user_id", as_index=False)
-        .agg(
-            employee_lifetime=(
-                "start_date",
-                lambda x: int(str(pd.to_datetime("2019-01-01") - x.min()).split()[0]),
-            ),
-            employee_last_experience=(
-                "start_date",
-                lambda x: int(str(pd.to_datetime("2019-01-01") - x.max()).split()[0]),
-            ),
-            employee_total_experience=(
-                "start_date",
-                lambda x: int(str(x.max() - x.min()).split()[0]),
-            ),
-            employee_last_days_to_quit=("days_to_quit", "last"),
-            employee_min_days_to_quit=("days_to_quit", "min"),
-            employee_max_days_to_quit=("days_to_quit", "max"),
-            employee_std_days_to_quit=("days_to_quit", "std"),
-            employee_med_days_to_quit=("days_to_quit", "median"),
-            employee_last_experience_month=("start_date", lambda x: x.max().month),
-            employee_last_experience_year=("start_date", lambda x: x.max().year),
-            # employee_first_experience_month=("start_date", lambda x: x.min().month),
-            employee_first_experience_year=("start_date", lambda x: x.min().year),
-            employee_nunique_company=("company_id", "nunique"),
-            # employee_nunique_location = ('location', 'nunique'),
-            # employee_last_location=('location', 'last'),
-            company_id=("company_id", "last"),
+    return order_work_experiences(state, by=["user_id", "start_date", "row"]).drop(columns=["row"])
+
+@profiled
+def employee_features(df_: pd.DataFrame) -> pd.DataFrame:
+
+    users = df_.groupby(by="user_id")
+    first_date = users["start_date"].min()
+    last_date = users["start_date"].max()
+    start_year = df_["start_date"].dt.year
+
+    return (
+        pd.DataFrame(
+            {
+                "employee_lifetime": (REFERENCE_DATE - first_date).dt.days,
+                "employee_last_experience": (REFERENCE_DATE - last_date).dt.days,
+                "employee_total_experience": (last_date - first_date).dt.days,
+                "employee_last_days_to_quit": users["days_to_quit"].last(),
+                "employee_min_days_to_quit": users["days_to_quit"].min(),
+                "employee_max_days_to_quit": users["days_to_quit"].max(),
+                "employee_std_days_to_quit": users["days_to_quit"].std(),
+                "employee_med_days_to_quit": users["days_to_quit"].median(),
+                "employee_last_experience_month": last_date.dt.month,
+                "employee_last_experience_year": last_date.dt.year,
+                # "employee_first_experience_month": first_date.dt.month,
+                "employee_first_experience_year": first_date.dt.year,
+                "employee_nunique_company": users["company_id"].nunique(),
+                # "employee_nunique_location": users["location"].nunique(),
+                # "employee_last_location": users["location"].last(),
+                "company_id": users["company_id"].last(),
+            }
         )
+        .reset_index()
         .assign(
             employee_avg_days_to_quit=lambda x: x.employee_lifetime
             / x.employee_nunique_company,
@@ -269,64 +499,318 @@ def load_work_experiences(path: str) -> pd.DataFrame:
                 2 * np.pi * x.employee_last_experience_month / 12
             ),
         )
-    )
-
-    emp_df = emp_df.merge(
-        df_[["user_id"]]
-        .drop_duplicates()
         .merge(
-            df_.loc[df_["start_date"].dt.year == 2018]
-            .groupby(by="user_id", as_index=False)
-            .agg(company_count_2018=("company_id", "count")),
+            pd.DataFrame(
+                {
+                    "company_count_2018": df_["company_id"].where(start_year == 2018).groupby(df_["user_id"]).count(),
+                    "company_count_2017": df_["company_id"].where(start_year == 2017).groupby(df_["user_id"]).count(),
+                }
+            ).reset_index(),
             on=["user_id"],
             how="left",
         )
-        .fillna({"company_count_2018": 0}),
-        on=["user_id"],
-        how="left",
     )
-    
-    emp_df = emp_df.merge(
-        df_[["user_id"]]
-        .drop_duplicates()
-        .merge(
-            df_.loc[df_["start_date"].dt.year == 2017]
-            .groupby(by="user_id", as_index=False)
-            .agg(company_count_2017=("company_id", "count")),
-            on=["user_id"],
-            how="left",
+
+@profiled
+def company_features(df_: pd.DataFrame) -> pd.DataFrame:
+
+    companies = df_.groupby(by="company_id")
+
+    return pd.DataFrame(
+        {
+            "company_avg_days_to_quit": companies["days_to_quit"].mean(),
+            "company_std_days_to_quit": companies["days_to_quit"].std(),
+            "company_max_days_to_quit": companies["days_to_quit"].max(),
+            # "company_min_days_to_quit": companies["days_to_quit"].min(),
+            "company_med_days_to_quit": companies["days_to_quit"].median(),
+            "company_skew_days_to_quit": companies["days_to_quit"].skew(),
+            "company_nunique_employees": companies["user_id"].nunique(),
+            # "company_nunique_location": companies["location"].nunique(),
+            "company_lifetime": (REFERENCE_DATE - companies["start_date"].min()).dt.days,
+            "company_last_hire": (REFERENCE_DATE - companies["start_date"].max()).dt.days,
+        }
+    ).reset_index()
+
+class WorkExperienceFeatures(BaseEstimator, TransformerMixin):
+
+    columns = ["user_id", "company_id", "location", "start_year_month"]
+
+    def fit(self, df_: pd.DataFrame, y=None):
+        self.companies_ = company_features(prepare_work_experiences(df_))
+        return self
+
+    def transform(self, df_: pd.DataFrame) -> pd.DataFrame:
+        return self.combine(employee_features(prepare_work_experiences(df_)))
+
+    def fit_transform(self, df_: pd.DataFrame, y=None) -> pd.DataFrame:
+        return self.fit_transform_prepared(prepare_work_experiences(df_))
+
+    def fit_transform_chunks(self, read_chunks) -> pd.DataFrame:
+        return self.fit_transform_prepared(stream_work_experiences(read_chunks()))
+
+    def fit_transform_prepared(self, df_: pd.DataFrame) -> pd.DataFrame:
+
+        self.companies_ = company_features(df_)
+
+        return self.combine(employee_features(df_))
+
+    def combine(self, emp_df: pd.DataFrame) -> pd.DataFrame:
+
+        return emp_df.merge(self.companies_, on=["company_id"], how="left").assign(
+            avg_days_to_quit_diff=lambda x: x.company_avg_days_to_quit
+            - x.employee_avg_days_to_quit,
+            avg_days_to_quit_ratio=lambda x: x.company_avg_days_to_quit
+            / x.employee_avg_days_to_quit,
+            company_hire_ratio=lambda x: x.company_lifetime / x.company_nunique_employees,
         )
-        .fillna({"company_count_2017": 0}),
-        on=["user_id"],
-        how="left",
-    )
 
-    comp_df = df_.groupby(by="company_id", as_index=False).agg(
-        company_avg_days_to_quit=("days_to_quit", "mean"),
-        company_std_days_to_quit=("days_to_quit", "std"),
-        company_max_days_to_quit=("days_to_quit", "max"),
-        # company_min_days_to_quit=("days_to_quit", "min"),
-        company_med_days_to_quit=("days_to_quit", "median"),
-        company_skew_days_to_quit=("days_to_quit", "skew"),
-        company_nunique_employees=("user_id", "nunique"),
-        # company_nunique_location = ('location', 'nunique'),
-        company_lifetime=(
-            "start_date",
-            lambda x: int(str(pd.to_datetime("2019-01-01") - x.min()).split()[0]),
-        ),
-        company_last_hire=(
-            "start_date",
-            lambda x: int(str(pd.to_datetime("2019-01-01") - x.max()).split()[0]),
-        ),
+def weighted_stats(counts: pd.DataFrame) -> pd.DataFrame:
+
+    # counts has one row per (company_id, value) with its multiplicity, the moments match pandas' nanops
+    counts = counts.sort_values(by=["company_id", "value"]).reset_index(drop=True)
+    groups = counts.groupby("company_id", sort=True)
+    n = groups["count"].transform("sum")
+    mean = (counts["value"] * counts["count"]).groupby(counts["company_id"]).transform("sum") / n
+    deviation = counts["value"] - mean
+    m2 = (counts["count"] * deviation ** 2).groupby(counts["company_id"]).sum()
+    m3 = (counts["count"] * deviation ** 3).groupby(counts["company_id"]).sum()
+    n, mean = groups["count"].sum(), mean.groupby(counts["company_id"]).first()
+    m2, m3 = m2.where(m2.abs() >= 1e-14, 0), m3.where(m3.abs() >= 1e-14, 0)
+
+    # the median sits at the rows covering positions (n - 1) // 2 and n // 2 of each sorted group
+    end = groups["count"].cumsum()
+    start = end - counts["count"]
+    total = counts["company_id"].map(n)
+    low = counts.loc[(start <= (total - 1) // 2) & ((total - 1) // 2 < end)].set_index("company_id")["value"]
+    high = counts.loc[(start <= total // 2) & (total // 2 < end)].set_index("company_id")["value"]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        skew = (n * (n - 1) ** 0.5 / (n - 2)) * (m3 / m2 ** 1.5)
+
+    return pd.DataFrame(
+        {
+            "mean": mean,
+            "std": np.sqrt(m2 / (n - 1)).where(n > 1),
+            "max": groups["value"].max(),
+            "median": (low + high) / 2,
+            "skew": skew.where(m2 != 0, 0).where(n > 2),
+        }
     )
 
-    return emp_df.merge(comp_df, on=["company_id"], how="left").assign(
-        avg_days_to_quit_diff=lambda x: x.company_avg_days_to_quit
-        - x.employee_avg_days_to_quit,
-        avg_days_to_quit_ratio=lambda x: x.company_avg_days_to_quit
-        / x.employee_avg_days_to_quit,
-        company_hire_ratio=lambda x: x.company_lifetime / x.company_nunique_employees,
+def update_counts_by_company(state: dict, df_: pd.DataFrame, column: str, sign: int) -> None:
+
+    counts = df_.groupby(["company_id", column]).size()
+    companies, values = (counts.index.get_level_values(i).tolist() for i in range(2))
+    for company, value, count in zip(companies, values, counts.tolist()):
+        counter = state.setdefault(company, dict())
+        counter[value] = counter.get(value, 0) + sign * count
+        if counter[value] == 0:
+            del counter[value]
+            if not counter:
+                del state[company]
+
+class IncrementalWorkExperienceFeatures(WorkExperienceFeatures):
+
+    def partial_fit(self, df_: pd.DataFrame, y=None):
+
+        if not hasattr(self, "experiences_"):
+            self.rows_seen_ = 0
+            self.experiences_ = None
+            self.employees_ = None
+            self.companies_ = None
+            self.days_ = dict()
+            self.dates_ = dict()
+
+        # new rows go after the history, the row position breaks start date ties like a full rebuild
+        delta = parse_work_experiences(
+            df_[self.columns].assign(row=np.arange(self.rows_seen_, self.rows_seen_ + df_.shape[0]))
+        )[["user_id", "company_id", "start_date", "row"]]
+        self.rows_seen_ += df_.shape[0]
+        if delta.empty:
+            return self
+        users = delta["user_id"].unique()
+
+        # only the touched users are re-ordered, their old rows leave the company state and the new ones enter it
+        if self.experiences_ is None:
+            touched = np.zeros(0, dtype=bool)
+            old = delta.iloc[:0].assign(days_to_quit=np.nan)
+        else:
+            touched = self.experiences_["user_id"].isin(users).values
+            old = self.experiences_.loc[touched]
+        new = order_work_experiences(
+            pd.concat([old[["user_id", "company_id", "start_date", "row"]], delta]), by=["user_id", "start_date", "row"]
+        )
+        for frame, sign in ((old, -1), (new, 1)):
+            update_counts_by_company(self.days_, frame, "days_to_quit", sign)
+            update_counts_by_company(self.dates_, frame.assign(start_date=frame["start_date"].values.astype("int64")), "start_date", sign)
+        companies = pd.unique(np.concatenate([old["company_id"].values, new["company_id"].values]))
+
+        # the untouched history is still copied once per delta, only the sorting and the statistics are incremental
+        self.experiences_ = pd.concat([self.experiences_.loc[~touched], new], ignore_index=True) if touched.size else new
+        employees = employee_features(new)
+        self.employees_ = employees if self.employees_ is None else pd.concat(
+            [self.employees_.loc[~self.employees_["user_id"].isin(users)], employees], ignore_index=True
+        )
+        companies_ = self.recompute_companies(companies)
+        self.companies_ = companies_ if self.companies_ is None else (
+            pd.concat([self.companies_.loc[~self.companies_["company_id"].isin(companies)], companies_])
+            .sort_values(by="company_id")
+            .reset_index(drop=True)
+        )
+
+        return self
+
+    def recompute_companies(self, companies) -> pd.DataFrame:
+
+        companies = [company for company in companies if company in self.dates_]
+        counters = [self.days_.get(company, dict()) for company in companies]
+        days = pd.DataFrame(
+            {
+                "company_id": np.repeat(companies, [len(counter) for counter in counters]),
+                "value": np.fromiter((value for counter in counters for value in counter), dtype=float),
+                "count": np.fromiter((count for counter in counters for count in counter.values()), dtype=np.int64),
+            }
+        )
+        stats = weighted_stats(days).reindex(companies)
+        dates = pd.DataFrame(
+            {
+                "first": np.array([min(self.dates_[company]) for company in companies], dtype="datetime64[ns]"),
+                "last": np.array([max(self.dates_[company]) for company in companies], dtype="datetime64[ns]"),
+                "rows": [sum(self.dates_[company].values()) for company in companies],
+            },
+            index=companies,
+        )
+
+        # rows are unique per (user, company), so a company's rows are its distinct employees
+        return pd.DataFrame(
+            {
+                "company_avg_days_to_quit": stats["mean"],
+                "company_std_days_to_quit": stats["std"],
+                "company_max_days_to_quit": stats["max"],
+                "company_med_days_to_quit": stats["median"],
+                "company_skew_days_to_quit": stats["skew"],
+                "company_nunique_employees": dates["rows"].astype("int64"),
+                "company_lifetime": (REFERENCE_DATE - dates["first"]).dt.days,
+                "company_last_hire": (REFERENCE_DATE - dates["last"]).dt.days,
+            }
+        ).rename_axis("company_id").reset_index().sort_values(by="company_id").reset_index(drop=True)
+
+    def features(self) -> pd.DataFrame:
+        return self.combine(self.employees_.sort_values(by="user_id").reset_index(drop=True))
+
+    def save(self, path: str) -> None:
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "IncrementalWorkExperienceFeatures":
+        return joblib.load(path)
+
+class FeaturePipeline:
+
+    def __init__(self, transformers: dict):
+        self.transformers = transformers
+
+    def fit(self, tables: dict):
+
+        for name, transformer in self.transformers.items():
+            transformer.fit(read_table(tables[name], transformer.columns))
+
+        return self
+
+    def transform(self, tables: dict, dataframe: pd.DataFrame = None) -> pd.DataFrame:
+
+        features = [
+            transformer.transform(read_table(tables[name], transformer.columns))
+            for name, transformer in self.transformers.items()
+        ]
+
+        return self.merge(features, dataframe)
+
+    def fit_transform(self, tables: dict, dataframe: pd.DataFrame = None) -> pd.DataFrame:
+
+        features = [
+            transformer.fit_transform(read_table(tables[name], transformer.columns))
+            for name, transformer in self.transformers.items()
+        ]
+
+        return self.merge(features, dataframe)
+
+    @staticmethod
+    def merge(features: list, dataframe: pd.DataFrame = None) -> pd.DataFrame:
+
+        if dataframe is None:
+            dataframe = pd.DataFrame(
+                {"user_id": pd.concat([f["user_id"] for f in features]).drop_duplicates().sort_values()}
+            )
+        df_ = dataframe.reset_index(drop=True)
+        for feature_df in features:
+            df_ = df_.merge(feature_df, on=["user_id"], how="left")
+
+        return df_
+
+    def save(self, path: str) -> None:
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "FeaturePipeline":
+        return joblib.load(path)
+
+def read_table(source, columns: list = None) -> pd.DataFrame:
+    return read_raw(source, columns) if isinstance(source, str) else source
+
+def fit_transform_file(transformer, path: str, chunksize: int = None, backend: str = "pandas") -> pd.DataFrame:
+
+    assert backend in ["pandas", "duckdb"], "Invalid Backend"
+    if backend == "duckdb":
+        from duckdb_backend import fit_transform
+
+        return fit_transform(transformer, path)
+
+    if chunksize is None:
+        return transformer.fit_transform(read_raw(path, transformer.columns))
+
+    return transformer.fit_transform_chunks(lambda: iter_raw(path, transformer.columns, chunksize))
+
+@profiled
+def load_skills(path: str, size: int = 50, exact_match: bool = True, sparse: bool = False, chunksize: int = None, backend: str = "pandas") -> pd.DataFrame:
+    return fit_transform_file(SkillFeatures(size, exact_match, sparse), path, chunksize, backend)
+
+@profiled
+def load_languages(path: str, size: int = 8, sparse: bool = False, chunksize: int = None, backend: str = "pandas"):
+    return fit_transform_file(LanguageFeatures(size, sparse), path, chunksize, backend)
+
+@profiled
+def load_school(path: str, size: int = 20, exact_match: bool = True, sparse: bool = False, chunksize: int = None, backend: str = "pandas") -> pd.DataFrame:
+    return fit_transform_file(SchoolFeatures(size, exact_match, sparse), path, chunksize, backend)
+
+@profiled
+def load_degree(path: str, size: int = 20, exact_match: bool = True, sparse: bool = False, chunksize: int = None, backend: str = "pandas") -> pd.DataFrame:
+    return fit_transform_file(DegreeFeatures(size, exact_match, sparse), path, chunksize, backend)
+
+@profiled
+def load_study(path: str, size: int = 20, exact_match: bool = True, sparse: bool = False, chunksize: int = None, backend: str = "pandas") -> pd.DataFrame:
+    return fit_transform_file(StudyFeatures(size, exact_match, sparse), path, chunksize, backend)
+
+@profiled
+def load_education(
+    path: str,
+    school_size: int = 20,
+    school_exact_match: bool = True,
+    degree_size: int = 20,
+    degree_exact_match: bool = True,
+    study_size: int = 20,
+    study_exact_match: bool = True,
+    sparse: bool = False,
+    chunksize: int = None,
+    backend: str = "pandas",
+) -> pd.DataFrame:
+
+    transformer = EducationFeatures(
+        school_size, school_exact_match, degree_size, degree_exact_match, study_size, study_exact_match, sparse
     )
 
+    return fit_transform_file(transformer, path, chunksize, backend)
 
-        
+@profiled
+def load_work_experiences(path: str, chunksize: int = None, backend: str = "pandas") -> pd.DataFrame:
+    return fit_transform_file(WorkExperienceFeatures(), path, chunksize, backend)
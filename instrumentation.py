@@ -0,0 +1,145 @@
+import json
+import time
+import functools
+import tracemalloc
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False
+        self.records = list()
+        self.stack = list()
+
+profiler = Profiler()
+
+def enable(memory: bool = True) -> None:
+
+    # tracemalloc makes allocation heavy stages noticeably slower, keep it optional
+    profiler.enabled = True
+    profiler.memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable() -> None:
+
+    profiler.enabled = False
+    if profiler.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    profiler.memory = False
+
+def reset() -> None:
+    profiler.records = list()
+    profiler.stack = list()
+
+def count_rows(obj):
+
+    # frames, series, arrays and matrices; paths, column lists and sizes have no rows
+    if isinstance(obj, tuple):
+        return count_rows(obj[0]) if obj else None
+    shape = getattr(obj, "shape", None)
+
+    return shape[0] if shape else None
+
+class Stage:
+
+    def __init__(self, name: str, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def rows(self, obj) -> None:
+        self.rows_out = count_rows(obj)
+
+    def __enter__(self):
+
+        self.path = "/".join([frame.name for frame in profiler.stack] + [self.name])
+        if profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if profiler.stack:
+                profiler.stack[-1].peak = max(profiler.stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory, self.peak = current, current
+        profiler.stack.append(self)
+        self.start, self.start_cpu = time.perf_counter(), time.process_time()
+
+        return self
+
+    def __exit__(self, *exc) -> None:
+
+        record = {
+            "stage": self.path,
+            "wall_seconds": time.perf_counter() - self.start,
+            "cpu_seconds": time.process_time() - self.start_cpu,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+        }
+        profiler.stack.pop()
+        if profiler.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            record["peak_mb"] = (self.peak - self.start_memory) / 2 ** 20
+            if profiler.stack:
+                profiler.stack[-1].peak = max(profiler.stack[-1].peak, self.peak)
+        profiler.records.append(record)
+
+class NullStage:
+
+    def rows(self, obj) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+NULL_STAGE = NullStage()
+
+def stage(name: str, rows_in=None):
+
+    if not profiler.enabled:
+        return NULL_STAGE
+
+    return Stage(name, count_rows(rows_in))
+
+def profiled(func=None, name: str = None):
+
+    if func is None:
+        return functools.partial(profiled, name=name)
+
+    label = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+            return func(*args, **kwargs)
+        # the first argument with rows, skips paths, sizes and self
+        rows_in = next((n for n in map(count_rows, args) if n is not None), None)
+        with Stage(label, rows_in) as current:
+            result = func(*args, **kwargs)
+            current.rows(result)
+        return result
+
+    return wrapper
+
+def report() -> dict:
+
+    # stages with the same path are summed, nested paths keep the sub-steps apart
+    summary = dict()
+    for record in profiler.records:
+        total = summary.setdefault(record["stage"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows_in": 0, "rows_out": 0})
+        total["calls"] += 1
+        for key in ("wall_seconds", "cpu_seconds", "rows_in", "rows_out"):
+            total[key] += record[key] or 0
+        if "peak_mb" in record:
+            total["peak_mb"] = max(total.get("peak_mb", 0.0), record["peak_mb"])
+
+    return {"records": profiler.records, "summary": summary}
+
+def save_report(path: str) -> dict:
+
+    result = report()
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+    return result
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from utils import compact_dtypes, memory_saved
+from feature_cache import FeatureCache, read_frame, write_frame
+
+def run_loader(func, path: str, args: tuple, kwargs: dict, stem: str, cache_dir: str = None, compact: bool = False) -> tuple:
+
+    # the frame goes back through a file, only its path and memory usage cross the process boundary
+    df_ = FeatureCache(cache_dir)(func, path, *args, **kwargs) if cache_dir else func(path, *args, **kwargs)
+    before = after = df_.memory_usage(index=False, deep=True).sum()
+    if compact:
+        df_ = compact_dtypes(df_, verbose=False)
+        after = df_.memory_usage(index=False, deep=True).sum()
+
+    return write_frame(df_, stem), before, after
+
+class LoaderGraph:
+
+    def __init__(self, n_jobs: int = None, cache_dir: str = None, compact: bool = False):
+        self.n_jobs = n_jobs
+        self.cache_dir = cache_dir
+        self.compact = compact
+        self.tasks = dict()
+        self.memory = dict()
+
+    def add(self, name: str, func, path: str, *args, depends: tuple = (), **kwargs) -> "LoaderGraph":
+        self.tasks[name] = (func, path, args, kwargs, tuple(depends))
+        return self
+
+    def ready(self, pending: dict, done: dict) -> list:
+        return [name for name, task in pending.items() if all(dep in done for dep in task[4])]
+
+    def run(self) -> dict:
+
+        unknown = {dep for task in self.tasks.values() for dep in task[4]} - set(self.tasks)
+        if unknown:
+            raise ValueError(f"unknown dependencies: {sorted(unknown)}")
+
+        n_jobs = self.n_jobs if self.n_jobs and self.n_jobs > 0 else os.cpu_count()
+        directory = tempfile.mkdtemp(prefix="loaders_")
+        pending, running, done = dict(self.tasks), dict(), dict()
+        try:
+            with ProcessPoolExecutor(max_workers=max(min(n_jobs, len(self.tasks)), 1)) as pool:
+                while pending or running:
+                    for name in self.ready(pending, done):
+                        func, path, args, kwargs, _ = pending.pop(name)
+                        stem = os.path.join(directory, name)
+                        running[pool.submit(run_loader, func, path, args, kwargs, stem, self.cache_dir, self.compact)] = name
+                    if not running:
+                        raise ValueError(f"dependency cycle between: {sorted(pending)}")
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        done[name], *self.memory[name] = future.result()
+                        if self.compact:
+                            print(memory_saved(name, *self.memory[name]))
+
+            return {name: read_frame(done[name]) for name in self.tasks}
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def join(self, df_: pd.DataFrame, results: dict, on: str = "user_id", how: str = "left") -> pd.DataFrame:
+
+        # merged in the order the loaders were added, same columns as merging them by hand;
+        # left merges bring back float64 for the rows a loader did not cover, so compact once more
+        for result in results.values():
+            df_ = df_.merge(result, on=on, how=how)
+
+        return compact_dtypes(df_, exclude=[on], name="joined") if self.compact else df_
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from blending import search_blend, weight_grid
+
+@pytest.mark.parametrize("step, low", [(0.02, 0.02), (0.1, 0.02), (0.05, 0.04), (0.01, 0.07), (0.25, 0.02)])
+def test_weight_grid_keeps_minimum_weight(step, low):
+
+    grid = weight_grid(3, step, low)
+
+    assert grid.shape[0] > 0
+    assert grid.min() >= low - 1e-12
+    np.testing.assert_allclose(grid.sum(axis=1), 1)
+
+def test_weight_grid_rejects_unreachable_minimum():
+    with pytest.raises(ValueError):
+        weight_grid(3, 0.25, 0.3)
+
+def test_search_blend_coarse_step_keeps_every_model():
+
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 2, 300)
+    scores = [np.clip(y * 0.3 + rng.random(300) * 0.7, 0, 1) for _ in range(3)]
+
+    assert search_blend(y, scores, step=0.1)["weights"].min() > 0
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+from data_profile import DataProfile
+
+def frame_with_nulls(n_rows: int = 400, seed: int = 0) -> pd.DataFrame:
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "a": rng.normal(size=n_rows),
+            "b": rng.integers(0, 5, n_rows).astype(float),
+            "c": rng.normal(size=n_rows),
+            "d": rng.exponential(size=n_rows),
+        }
+    )
+    df["c"] += df["a"]
+    for col, share in (("b", 0.2), ("c", 0.1)):
+        df.loc[rng.random(n_rows) < share, col] = np.nan
+
+    return df
+
+def test_spearman_matches_pandas_with_nulls():
+
+    df = frame_with_nulls()
+    got = DataProfile.from_frame(df).corr("spearman")
+
+    np.testing.assert_allclose(got.values, df.corr("spearman").values, rtol=0, atol=1e-12)
+
+def test_pearson_matches_pandas_over_chunks():
+
+    df = frame_with_nulls()
+    got = DataProfile.from_chunks(np.array_split(df, 7)).corr("pearson")
+
+    np.testing.assert_allclose(got.values, df.corr("pearson").values, rtol=0, atol=1e-12)
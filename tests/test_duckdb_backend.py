@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+from benchmark import generate_data
+from utils import convert_to_columnar
+from feature_extraction import (
+    load_degree,
+    load_education,
+    load_languages,
+    load_school,
+    load_skills,
+    load_study,
+    load_work_experiences,
+)
+
+pytest.importorskip("duckdb")
+
+CASES = [
+    (load_skills, "skills", (30, True)),
+    (load_skills, "skills", (20, False)),
+    (load_skills, "skills", (30, True, True)),
+    (load_languages, "languages", (8,)),
+    (load_school, "education", (20, True)),
+    (load_school, "education", (20, False)),
+    (load_degree, "education", (8, True)),
+    (load_degree, "education", (8, False)),
+    (load_study, "education", (20, True)),
+    (load_study, "education", (20, False)),
+    (load_education, "education", (30, True, 8, True, 20, False)),
+    (load_education, "education", (30, True, 8, False, 20, True, True)),
+    (load_work_experiences, "work_experiences", ()),
+]
+
+@pytest.fixture(scope="module")
+def tables(tmp_path_factory) -> dict:
+
+    directory = tmp_path_factory.mktemp("tables")
+    paths = generate_data(str(directory), 5_000)
+    tables = {"csv": paths}
+    for fmt, ext in (("parquet", "parquet"), ("feather", "feather")):
+        tables[ext] = {name: convert_to_columnar(paths[name], fmt=fmt) for name in paths if name != "users"}
+
+    return tables
+
+@pytest.mark.parametrize("ext", ["csv", "parquet", "feather"])
+@pytest.mark.parametrize("loader, table, args", CASES)
+def test_duckdb_matches_pandas(tables, ext, loader, table, args):
+
+    path = tables[ext][table]
+    expected = loader(path, *args)
+    got = loader(path, *args, backend="duckdb")
+
+    pd.testing.assert_frame_equal(got, expected, check_exact=False, rtol=1e-9)
@@ -0,0 +1,107 @@
+import os
+import sys
+import importlib
+import pandas as pd
+import feature_cache
+from feature_cache import FeatureCache
+
+LOADER = '''
+import pandas as pd
+import feature_cache
+from instrumentation import profiled
+
+@profiled
+def load_values(path: str, size: int = 1) -> pd.DataFrame:
+    return pd.DataFrame({{"user_id": [1], "value": [{value}]}})
+'''
+
+def write_loader(directory, value) -> None:
+    (directory / "cached_loader.py").write_text(LOADER.format(value=value))
+
+def test_cache_invalidated_when_loader_module_changes(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    data = tmp_path / "data.csv"
+    data.write_text("user_id\n1\n")
+    cache = FeatureCache(str(tmp_path / "cache"))
+
+    write_loader(tmp_path, 1)
+    module = importlib.import_module("cached_loader")
+    assert cache(module.load_values, str(data))["value"].tolist() == [1]
+    assert cache(module.load_values, str(data))["value"].tolist() == [1]
+
+    write_loader(tmp_path, 22)
+    module = importlib.reload(module)
+    assert cache(module.load_values, str(data))["value"].tolist() == [22]
+    sys.modules.pop("cached_loader", None)
+
+def test_cache_invalidated_when_a_dependency_changes(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(sys, "dont_write_bytecode", True)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    data = tmp_path / "data.csv"
+    data.write_text("user_id\n1\n")
+    cache = FeatureCache(str(tmp_path / "cache"))
+    dependency = tmp_path / "loader_dependency.py"
+    monkeypatch.setattr(feature_cache, "CODE_DEPENDENCIES", feature_cache.CODE_DEPENDENCIES + ("loader_dependency",))
+    calls = list()
+
+    def load_values(path: str) -> pd.DataFrame:
+        calls.append(path)
+        return pd.DataFrame({"user_id": [1]})
+
+    dependency.write_text("TABLE = 1\n")
+    cache(load_values, str(data))
+    cache(load_values, str(data))
+    assert len(calls) == 1
+
+    dependency.write_text("TABLE = 22\n")
+    cache(load_values, str(data))
+    assert len(calls) == 2
+
+def test_missing_sidecar_is_a_miss_and_orphans_are_removed(tmp_path):
+
+    data = tmp_path / "data.csv"
+    data.write_text("user_id\n1\n")
+    cache = FeatureCache(str(tmp_path / "cache"))
+    calls = list()
+
+    def load_values(path: str, value: int = 1) -> pd.DataFrame:
+        calls.append(path)
+        return pd.DataFrame({"user_id": [1], "value": [value]})
+
+    cache(load_values, str(data))
+    for file in (tmp_path / "cache").glob("*.json"):
+        file.unlink()
+    assert cache(load_values, str(data))["value"].tolist() == [1]
+    assert len(calls) == 2
+
+    # a data file left without its sidecar is cleaned up on the next eviction
+    (tmp_path / "cache" / "orphan.parquet").write_bytes(b"")
+    cache(load_values, str(data), 2)
+    files = sorted(file.name for file in (tmp_path / "cache").iterdir())
+    assert len(files) == 4 and "orphan.parquet" not in files
+
+def test_evict_tolerates_entries_removed_by_another_process(tmp_path, monkeypatch):
+
+    data = tmp_path / "data.csv"
+    data.write_text("user_id\n1\n")
+    cache = FeatureCache(str(tmp_path / "cache"), max_size=0)
+
+    def load_values(path: str, value: int = 1) -> pd.DataFrame:
+        return pd.DataFrame({"user_id": [1], "value": [value]})
+
+    for value in range(3):
+        cache(load_values, str(data), value)
+    load = feature_cache.json.load
+
+    def load_and_remove(f):
+        # another worker evicts the entry right after its sidecar was opened
+        meta = load(f)
+        cache.remove(os.path.basename(f.name)[:-5])
+        return meta
+
+    monkeypatch.setattr(feature_cache.json, "load", load_and_remove)
+    cache.evict()
+    assert cache.entries() == []
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from sklearn.feature_extraction.text import CountVectorizer
+from benchmark import generate_data
+from feature_extraction import (
+    IncrementalWorkExperienceFeatures,
+    WorkExperienceFeatures,
+    load_languages,
+    load_skills,
+    load_work_experiences,
+)
+
+LANGUAGES = pd.DataFrame(
+    {
+        "user_id": [1, 1, 1, 1, 2, 2, 3],
+        "language": ["english", "english", "english", "turkish", "english", "german", "turkish"],
+        "proficiency": ["full_professional", "elementary", "elementary", None, "native_or_bilingual", None, None],
+    }
+)
+
+def previous_languages(path: str) -> pd.DataFrame:
+
+    # the previous loader, repeated rows are dropped over the full row
+    df_ = pd.read_csv(path).drop_duplicates()
+    vectorizer = CountVectorizer(max_features=8, ngram_range=(1, 1))
+
+    return (
+        pd.DataFrame(
+            vectorizer.fit_transform(df_["language"]).toarray(),
+            columns=[f"language_{str(f)}" for f in vectorizer.get_feature_names()],
+        )
+        .assign(user_id=df_["user_id"].tolist())
+        .groupby(by="user_id", as_index=False)
+        .sum()
+        .merge(df_.groupby(by="user_id", as_index=False).agg(total_languages=("language", "nunique")), on=["user_id"], how="left")
+    )
+
+@pytest.mark.parametrize("options", [{}, {"chunksize": 1}, {"chunksize": 3}, {"backend": "duckdb"}])
+def test_languages_count_each_proficiency(tmp_path, options):
+
+    if options.get("backend") == "duckdb":
+        pytest.importorskip("duckdb")
+    path = str(tmp_path / "languages.csv")
+    LANGUAGES.to_csv(path, index=False)
+
+    got = load_languages(path, **options)
+
+    assert got.loc[got["user_id"] == 1, "language_english"].item() == 2
+    pd.testing.assert_frame_equal(got[previous_languages(path).columns], previous_languages(path), check_dtype=False)
+
+@pytest.fixture(scope="module")
+def tables(tmp_path_factory) -> dict:
+    return generate_data(str(tmp_path_factory.mktemp("tables")), 3_000)
+
+@pytest.mark.parametrize("loader, table, args", [
+    (load_skills, "skills", (30, True)),
+    (load_skills, "skills", (20, False)),
+    (load_languages, "languages", (8,)),
+    (load_work_experiences, "work_experiences", ()),
+])
+@pytest.mark.parametrize("chunksize", [97, 1_000])
+def test_chunked_loaders_match_in_memory(tables, loader, table, args, chunksize):
+
+    expected = loader(tables[table], *args)
+    got = loader(tables[table], *args, chunksize=chunksize)
+
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+def test_incremental_work_experiences_match_a_full_rebuild(tables, tmp_path):
+
+    df = pd.read_csv(tables["work_experiences"])
+    cuts = [0, int(df.shape[0] * 0.7), int(df.shape[0] * 0.8), int(df.shape[0] * 0.9), df.shape[0]]
+    incremental = IncrementalWorkExperienceFeatures()
+
+    for start, end in zip(cuts, cuts[1:]):
+        incremental.partial_fit(df.iloc[start:end])
+        expected = WorkExperienceFeatures().fit_transform(df.iloc[:end])
+        pd.testing.assert_frame_equal(incremental.features(), expected, check_exact=False, rtol=1e-9)
+
+    incremental.save(str(tmp_path / "incremental.joblib"))
+    restored = IncrementalWorkExperienceFeatures.load(str(tmp_path / "incremental.joblib"))
+    pd.testing.assert_frame_equal(restored.features(), incremental.features())
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import indicator_loop
+from feature_extraction import SkillFeatures, count_indicators, load_degree, load_school, load_skills
+
+def skills_frame() -> pd.DataFrame:
+
+    # every value appears the same number of times, so the top-N cut falls inside a tie
+    rng = np.random.default_rng(0)
+    values = np.repeat([f"skill {i}" for i in range(12)], 5).astype(object)
+    df = pd.DataFrame({"user_id": rng.integers(0, 15, values.shape[0]), "skill": rng.permutation(values)})
+    df.loc[df.sample(6, random_state=0).index, "skill"] = np.nan
+
+    return df
+
+def test_count_indicators_matches_loop_with_nan():
+
+    df = skills_frame()
+    values = df["skill"].value_counts()[:5].keys().tolist()
+
+    pd.testing.assert_frame_equal(count_indicators(df, "skill", values), indicator_loop(df, "skill", values))
+
+def test_top_values_match_value_counts_on_ties():
+
+    df = skills_frame().drop_duplicates().dropna(subset=["skill"])
+
+    for size in (1, 5, 11):
+        assert SkillFeatures(size).fit(df).values_ == df["skill"].value_counts()[:size].keys().tolist()
+
+@pytest.mark.parametrize("loader, feature, columns", [
+    (load_skills, "skill", ["user_id", "skill"]),
+    (load_school, "school_name", ["user_id", "school_name"]),
+    (load_degree, "degree", ["user_id", "degree"]),
+])
+def test_exact_match_loaders_match_loop(tmp_path, loader, feature, columns):
+
+    df = skills_frame().rename(columns={"skill": feature})
+    path = tmp_path / f"{feature}.csv"
+    df.to_csv(path, index=False)
+
+    # the previous loaders: skills are deduplicated, degrees count missing as "" but never keep it as a value
+    raw = pd.read_csv(path)[columns]
+    if feature == "skill":
+        raw = raw.drop_duplicates().dropna(subset=["skill"])
+    if feature == "degree":
+        raw = raw.fillna("")
+        values = raw.loc[raw["degree"] != "", "degree"].value_counts()[:5].keys().tolist()
+    else:
+        values = raw[feature].value_counts()[:5].keys().tolist()
+    expected = indicator_loop(raw, feature, values)
+
+    got = loader(str(path), 5, True)
+    pd.testing.assert_frame_equal(got[expected.columns], expected)
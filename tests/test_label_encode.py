@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import OrdinalEncoder
+from utils import label_encode
+
+def frames() -> tuple:
+
+    # missing values read from a CSV are NaN, test has an unseen value
+    train = pd.DataFrame({"city": ["b", "a", np.nan, "c", "a"], "size": [3, 1, 2, 3, 1]})
+    test = pd.DataFrame({"city": ["a", "d", np.nan, "c"], "size": [1, 5, 2, 3]})
+
+    return train, test
+
+def ordinal_encode(le_cols: list, train: pd.DataFrame, test: pd.DataFrame, fillna: bool) -> tuple:
+
+    # the previous implementation
+    train_, test_ = train.copy(), test.copy()
+    for col in le_cols:
+        encoder = OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=np.nan)
+        train_[col] = encoder.fit_transform(train_[col].values.reshape(-1, 1))
+        test_[col] = encoder.transform(test_[col].values.reshape(-1, 1))
+        if fillna and test_[col].isnull().sum() != 0:
+            max_ = max(train_[col].dropna().astype(int).max(), test_[col].dropna().astype(int).max())
+            test_[col] = test_[col].fillna(max_ + 1)
+            train_[col] = train_[col].fillna(max_ + 1)
+
+    return train_, test_
+
+@pytest.mark.parametrize("fillna", [False, True])
+def test_label_encode_matches_ordinal_encoder(fillna):
+
+    train, test = frames()
+    got = label_encode(["city", "size"], train, test, fillna)
+
+    for left, right in zip(got, ordinal_encode(["city", "size"], train, test, fillna)):
+        pd.testing.assert_frame_equal(left, right)
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+from utils import PlotQueue, draw_importances
+
+def broken_draw(fig, ax, data, title):
+    raise ValueError("cannot draw")
+
+def test_close_warns_about_failed_plots(tmp_path):
+
+    plots = PlotQueue(str(tmp_path))
+    plots.submit(draw_importances, pd.Series({"a": 1.0, "b": 2.0}), "importances")
+    plots.submit(broken_draw, None, "broken")
+
+    with pytest.warns(RuntimeWarning, match="1 plot"):
+        plots.close()
+    assert (tmp_path / "importances.jpg").exists()
+
+def test_join_reports_each_failure_once(tmp_path, recwarn):
+
+    with PlotQueue(str(tmp_path)) as plots:
+        plots.submit(broken_draw, None, "broken")
+        plots.join()
+        assert len([w for w in recwarn if issubclass(w.category, RuntimeWarning)]) == 1
+    assert len([w for w in recwarn if issubclass(w.category, RuntimeWarning)]) == 1
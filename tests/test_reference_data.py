@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+from utils import LocationNormalizer, add_employment, add_populations
+
+def test_reference_columns_ignore_categorical_locations():
+
+    df = pd.DataFrame({"user_id": [1, 2, 3], "location": ["ADANA", "ADIYAMAN", "ADANA"]})
+    compacted = df.assign(location=df["location"].astype("category"))
+
+    for add in (add_populations, add_employment):
+        expected = add(df)
+        got = add(compacted)
+        assert not isinstance(got.iloc[:, -1].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(got.drop(columns="location"), expected.drop(columns="location"))
+
+def test_location_nulls_do_not_depend_on_call_order():
+
+    for order in ([np.nan, None], [None, np.nan]):
+        normalizer = LocationNormalizer()
+        for value in order:
+            normalizer.normalize(pd.Series(["Istanbul, Turkey", value], dtype=object))
+        got = normalizer.normalize(pd.Series([np.nan, None, "Istanbul, Turkey"], dtype=object))
+        assert got.tolist() == ["NAN", "NONE", "ISTANBUL"]
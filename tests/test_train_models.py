@@ -0,0 +1,69 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.model_selection import StratifiedKFold
+from xgboost import XGBClassifier
+from train_models import get_model_scores, to_model_input
+
+def training_frames(n_rows: int = 200, seed: int = 0) -> tuple:
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "skill_python": rng.integers(0, 3, n_rows),
+            "employee_lifetime": rng.normal(1000, 300, n_rows),
+            "industry": pd.Categorical(rng.choice(["a", "b", "c"], n_rows)),
+            "moved_after_2019": rng.integers(0, 2, n_rows).astype(float),
+        }
+    )
+
+    return df.iloc[:160], df.iloc[160:]
+
+class StopTraining(Exception):
+    pass
+
+def test_shared_matrix_directory_removed_when_a_fold_raises(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    # the confusion matrix plot is written under the working directory
+    monkeypatch.chdir(tmp_path)
+    train_set, test_set = training_frames()
+    model = XGBClassifier(n_estimators=5, max_depth=2, tree_method="hist", enable_categorical=True, random_state=0)
+
+    def stop(fold, score):
+        raise StopTraining
+
+    with pytest.raises(StopTraining):
+        get_model_scores(
+            model, StratifiedKFold(2), train_set, test_set, "moved_after_2019", 2, shared_matrix=True, fold_callback=stop
+        )
+
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("training_matrix_")]
+
+def test_sparse_indicators_train_the_dense_xgboost_model(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "plots").mkdir()
+    train_set, test_set = training_frames()
+    sparse = {"skill_python": pd.SparseDtype("int64", 0)}
+    model = lambda: XGBClassifier(n_estimators=10, max_depth=2, tree_method="hist", enable_categorical=True, random_state=0)
+
+    dense_score, dense_oof = get_model_scores(model(), StratifiedKFold(2), train_set, test_set, "moved_after_2019", 2)
+    sparse_score, sparse_oof = get_model_scores(
+        model(), StratifiedKFold(2), train_set.astype(sparse), test_set.astype(sparse), "moved_after_2019", 2
+    )
+
+    np.testing.assert_array_equal(sparse_oof, dense_oof)
+    np.testing.assert_array_equal(sparse_score, dense_score)
+
+def test_sparse_columns_are_densified_for_xgboost():
+
+    train_set, _ = training_frames()
+    X = train_set.astype({"skill_python": pd.SparseDtype("int64", 0)})
+
+    got = to_model_input(XGBClassifier(), X)
+
+    assert got.dtypes.equals(train_set.dtypes)
+    pd.testing.assert_frame_equal(got, train_set)
@@ -0,0 +1,27 @@
+import pytest
+from sklearn.model_selection import StratifiedKFold
+from xgboost import XGBClassifier
+from test_train_models import training_frames
+
+optuna = pytest.importorskip("optuna")
+from tuning import tune, xgb_search_space
+
+def make_model(params: dict) -> XGBClassifier:
+    return XGBClassifier(n_estimators=5, tree_method="hist", enable_categorical=True, random_state=0, **params)
+
+def test_parallel_trials_share_the_study_and_record_pruning(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    train_set, _ = training_frames()
+    storage = f"sqlite:///{tmp_path / 'tuning.db'}"
+
+    # no accuracy reaches the threshold, so every trial is pruned after its first fold
+    study = tune(
+        make_model, xgb_search_space, train_set, "moved_after_2019", StratifiedKFold(3), 3,
+        n_trials=2, n_jobs=2, storage=storage, pruner=optuna.pruners.ThresholdPruner(lower=1.1),
+    )
+
+    states = [trial.state for trial in study.trials]
+    assert len(states) == 2
+    assert optuna.trial.TrialState.PRUNED in states
+    assert all(len(trial.intermediate_values) == 1 for trial in study.trials)
@@ -0,0 +1,58 @@
+import re
+import functools
+import numpy as np
+import pandas as pd
+
+TURKISH_CHARACTERS = str.maketrans("ÜüÖöİıĞğŞşÇç", "UuOoIiGgSsCc")
+WHITESPACE = re.compile(r"\s+")
+CACHE_SIZE = 2 ** 16
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def translation(x: str) -> str:
+    return x.translate(TURKISH_CHARACTERS)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def normalize_text(x: str) -> str:
+    return translation(x.lower().strip())
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def tokenize(text: str) -> tuple:
+    return tuple(WHITESPACE.split(text))
+
+def my_tokenizer(text):
+    # a fresh list per call, the cached tuple is shared
+    return list(tokenize(text))
+
+@functools.lru_cache(maxsize=None)
+def english_stopwords() -> tuple:
+
+    from nltk.corpus import stopwords
+
+    return tuple(stopwords.words("english"))
+
+def stop_words() -> list:
+    return list(english_stopwords())
+
+def apply_unique(series: pd.Series, func) -> pd.Series:
+
+    # each distinct string is processed once and broadcast back over the rows,
+    # missing values get code -1 and pick up the trailing NaN
+    codes, uniques = pd.factorize(series)
+    values = np.array([func(x) for x in uniques] + [np.nan], dtype=object)
+
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+def translate_series(series: pd.Series) -> pd.Series:
+    return apply_unique(series, translation)
+
+def normalize_series(series: pd.Series) -> pd.Series:
+    return apply_unique(series, normalize_text)
+
+def transform_unique(vectorizer, documents: pd.Series):
+
+    # the vectorizer sees every distinct document once, rows are gathered from its output
+    codes, uniques = pd.factorize(documents)
+    if (codes < 0).any():
+        return vectorizer.transform(documents)
+
+    return vectorizer.transform(uniques)[codes]
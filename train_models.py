@@ -1,67 +1,458 @@
 import gc
+import os
+import uuid
+import shutil
+import tempfile
+import warnings
+import joblib
 import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from scipy.sparse import csr_matrix, hstack
 from sklearn.metrics import confusion_matrix, accuracy_score
-from utils import plot_importances, plot_confusion_matrix
+from utils import PlotQueue, plot_importances, plot_confusion_matrix
+from instrumentation import profiled, stage
 
-def get_model_scores(model, splitter, train_set, test_set, target: str, n_folds: int, plot_imp: bool = False):
+def model_library(model) -> str:
+    return type(model).__module__.split(".")[0]
 
-    X = train_set.drop(columns=[target], axis=1).copy()
-    y = train_set[target].copy()
-    features = X.columns
+def to_model_input(model, X: pd.DataFrame, sparse_missing: bool = False):
 
-    X_test = test_set.drop(columns=[target], axis=1).copy()
+    # CatBoost reads SparseDtype columns natively and fills the gaps with 0
+    sparse_cols = [col for col in X.columns if isinstance(X[col].dtype, pd.SparseDtype)]
+    if not sparse_cols or model_library(model) != "xgboost":
+        return X
+
+    # XGBoost reads entries left out of a sparse matrix as missing, not 0, so by default the
+    # sparse columns are densified and the model is the same as on dense features
+    if not sparse_missing:
+        return X.assign(**{col: X[col].sparse.to_dense() for col in sparse_cols})
+    warnings.warn(
+        "sparse_missing=True: XGBoost treats the zero counts of the sparse columns as missing values, "
+        "the model differs from one trained on dense features",
+        UserWarning,
+    )
+
+    dense_cols = [col for col in X.columns if col not in sparse_cols]
+    dense = np.zeros((X.shape[0], len(dense_cols)), dtype=np.float32)
+    for i, col in enumerate(dense_cols):
+        if X[col].dtype.name == "category":
+            dense[:, i] = X[col].cat.codes.replace(-1, np.nan)
+        else:
+            dense[:, i] = X[col]
+
+    # dense values are stored explicitly, XGBoost treats absent entries as missing
+    n_rows, n_cols = dense.shape
+    dense = csr_matrix(
+        (dense.ravel(), np.tile(np.arange(n_cols), n_rows), np.arange(0, n_rows * n_cols + 1, n_cols)),
+        shape=dense.shape,
+    )
+    position = {col: i for i, col in enumerate(sparse_cols + dense_cols)}
+    matrix = hstack([X[sparse_cols].sparse.to_coo(), dense]).tocsc()
+
+    model.set_params(
+        feature_types=["c" if X[col].dtype.name == "category" else "q" for col in X.columns]
+    )
+
+    return matrix[:, [position[col] for col in X.columns]].tocsr()
+
+def clone_model(model):
+
+    # sklearn's clone trips over CatBoost's cat_features handling
+    return model.copy() if model_library(model) == "catboost" else clone(model)
+
+def take_rows(X, ind):
+    return X.iloc[ind] if isinstance(X, pd.DataFrame) else X[ind]
+
+class TrainingMatrix:
+
+    def __init__(self, values: np.ndarray, columns: list, categories: dict):
+        self.values = values
+        self.columns = list(columns)
+        self.categories = categories
+        self.cached_pool = None
+
+    def __getstate__(self) -> dict:
+        # fold workers get the mapped buffer, not the CatBoost pool built in the parent
+        return dict(self.__dict__, cached_pool=None)
+
+    @classmethod
+    def from_frame(cls, df_: pd.DataFrame, columns: list = None, directory: str = None, categories: dict = None):
+
+        # one float32 buffer, categorical columns hold their codes and NaN for missing
+        columns = df_.columns if columns is None else columns
+        categories = dict() if categories is None else categories
+        values = np.empty((df_.shape[0], len(columns)), dtype=np.float32)
+        matrix_categories = dict()
+        for i, col in enumerate(columns):
+            if col in categories or df_[col].dtype.name == "category":
+                matrix_categories[col] = categories[col] if col in categories else df_[col].cat.categories
+                codes = pd.Categorical(df_[col], categories=matrix_categories[col]).codes
+                values[:, i] = np.where(codes < 0, np.nan, codes)
+            elif isinstance(df_[col].dtype, pd.SparseDtype):
+                values[:, i] = df_[col].sparse.to_dense()
+            else:
+                values[:, i] = df_[col]
+
+        matrix = cls(values, columns, matrix_categories)
+
+        return matrix if directory is None else matrix.share(directory)
+
+    def share(self, directory: str):
+
+        # fold workers map the same read-only file instead of receiving a pickled copy
+        path = os.path.join(directory, f"{uuid.uuid4().hex}.npy")
+        np.save(path, self.values)
+        self.values = np.load(path, mmap_mode="r")
+
+        return self
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    @property
+    def num_index(self) -> list:
+        return [i for i, col in enumerate(self.columns) if col not in self.categories]
+
+    @property
+    def cat_index(self) -> list:
+        return [i for i, col in enumerate(self.columns) if col in self.categories]
+
+    def prepare_model(self, model):
+
+        if model_library(model) == "xgboost":
+            model.set_params(feature_types=["c" if col in self.categories else "q" for col in self.columns])
+
+        return model
+
+    def feature_names(self, model) -> list:
+
+        # CatBoost's FeaturesData puts the numeric block before the categorical one
+        if model_library(model) == "catboost":
+            return [self.columns[i] for i in self.num_index + self.cat_index]
+
+        return self.columns
+
+    def rows(self, model, ind=None, y=None):
+
+        library = model_library(model)
+        if library == "catboost":
+            pool = self.pool(y)
+            return pool if ind is None else pool.slice(ind)
+
+        # fancy indexing copies the fold rows, as float32 instead of a DataFrame; XGBoost builds its own matrix from them anyway
+        values = self.values if ind is None else self.values[ind]
+
+        return values if library == "xgboost" else self.frame(values)
+
+    def pool(self, y=None):
+
+        # the categorical string block is built once for every fold, folds slice the pool
+        if self.cached_pool is None or self.cached_pool[0] is not y:
+            from catboost import Pool
+            self.cached_pool = (y, Pool(self.features_data(self.values), label=None if y is None else np.asarray(y)))
+
+        return self.cached_pool[1]
+
+    def features_data(self, values: np.ndarray):
+
+        from catboost import FeaturesData
+
+        cat_data = np.empty((values.shape[0], len(self.cat_index)), dtype=object)
+        for j, i in enumerate(self.cat_index):
+            labels = np.append(self.categories[self.columns[i]].astype(str).values, "nan")
+            cat_data[:, j] = labels[np.nan_to_num(values[:, i], nan=-1).astype(int)]
+
+        return FeaturesData(
+            num_feature_data=np.ascontiguousarray(values[:, self.num_index]),
+            cat_feature_data=cat_data,
+            num_feature_names=[self.columns[i] for i in self.num_index],
+            cat_feature_names=[self.columns[i] for i in self.cat_index],
+        )
+
+    def frame(self, values: np.ndarray) -> pd.DataFrame:
+
+        df_ = pd.DataFrame(values, columns=self.columns)
+        for col, categories in self.categories.items():
+            codes = np.nan_to_num(df_[col].values, nan=-1).astype(int)
+            df_[col] = pd.Categorical.from_codes(codes, categories=categories)
+
+        return df_
+
+def fold_data(model, X, y, ind):
+
+    if not isinstance(X, TrainingMatrix):
+        return take_rows(X, ind), y.iloc[ind]
+    if model_library(model) == "catboost":
+        return X.rows(model, ind, y), None
+
+    return X.rows(model, ind), y.iloc[ind]
+
+def set_thread_budget(model, n_threads: int):
+
+    params = model.get_params()
+    if "thread_count" in params:
+        model.set_params(thread_count=n_threads)
+    elif "n_jobs" in params:
+        model.set_params(n_jobs=n_threads)
+
+    return model
+
+def fit_fold(model, X, y, X_test, train_ind, val_ind, idx: int):
+
+    print(f"| Fold {idx+1} |".center(80, "-"))
+    with stage(f"fold {idx + 1}", train_ind) as current:
+        result = train_fold(model, X, y, X_test, train_ind, val_ind)
+        current.rows(result[1])
+
+    return result
+
+def train_fold(model, X, y, X_test, train_ind, val_ind):
+
+    X_train, y_train = fold_data(model, X, y, train_ind)
+    X_val, y_val = fold_data(model, X, y, val_ind)
+    if isinstance(X_test, TrainingMatrix):
+        X_test = X_test.rows(model)
+    print(f'train: {X_train.shape}')
+    print(f'val: {X_val.shape}')
+
+    #Training Classifier
+    model.fit(
+        X_train,
+        y_train,
+        eval_set=X_val if y_val is None else [(X_val, y_val)],
+        early_stopping_rounds=500,
+        verbose=250,
+    )
+
+    #Validation Predictions
+    val_score = model.predict_proba(X_val)
+
+    #Test Predictions
+    test_score = None if X_test is None else model.predict_proba(X_test)
+
+    del X_train, y_train, X_val, y_val
+    gc.collect()
+
+    return model, val_score, test_score
+
+def to_labels(score: np.ndarray, threshold: float = None) -> np.ndarray:
+
+    # without a threshold this is what predict does, ties at 0.5 go to class 0
+    if threshold is None:
+        return score.argmax(axis=1)
+
+    return np.where(score[:, 1] >= threshold, 1, 0)
+
+def share_training_data(train_set: pd.DataFrame, test_set: pd.DataFrame, target: str, directory: str) -> tuple:
+
+    # built straight from the input frames, without the dropped-target copies
+    columns = train_set.columns.drop(target)
+    X = TrainingMatrix.from_frame(train_set, columns, directory)
+    X_test = None if test_set is None else TrainingMatrix.from_frame(test_set, columns, directory, categories=X.categories)
+
+    return X, train_set[target].copy(), X_test
+
+def as_batches(batches):
+    return [batches] if isinstance(batches, pd.DataFrame) else batches
+
+class FoldEnsemble:
+
+    def __init__(self, models: list, columns: list, categories: dict, matrix: bool = False, sparse_missing: bool = False):
+        self.models = models
+        self.columns = list(columns)
+        self.categories = categories
+        self.matrix = matrix
+        self.sparse_missing = sparse_missing
+
+    def model_input(self, model, batch: pd.DataFrame):
+
+        if self.matrix:
+            return TrainingMatrix.from_frame(batch, self.columns, categories=self.categories).rows(model)
+
+        # batches read separately do not share the training categories
+        X = batch[self.columns].copy()
+        for col, categories in self.categories.items():
+            X[col] = pd.Categorical(X[col], categories=categories)
+
+        # ensembles saved before sparse_missing existed were trained on dense input
+        return to_model_input(model, X, getattr(self, "sparse_missing", False))
+
+    def predict_batch(self, batch: pd.DataFrame) -> np.ndarray:
+
+        score = np.zeros((batch.shape[0], 2))
+        for model in self.models:
+            score += model.predict_proba(self.model_input(model, batch)) / len(self.models)
+
+        return score
+
+    def predict_proba(self, batches):
+        for batch in as_batches(batches):
+            yield self.predict_batch(batch)
+
+    def save(self, path: str) -> None:
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "FoldEnsemble":
+        return joblib.load(path)
+
+class BlendedEnsemble:
+
+    def __init__(self, ensembles: list, weights: list, threshold: float = 0.499):
+        self.ensembles = ensembles
+        self.weights = weights
+        self.threshold = threshold
+
+    def predict_batch(self, batch: pd.DataFrame) -> np.ndarray:
+        return sum(ensemble.predict_batch(batch) * weight for ensemble, weight in zip(self.ensembles, self.weights))
+
+    def predict_proba(self, batches):
+        for batch in as_batches(batches):
+            yield self.predict_batch(batch)
+
+    def predict(self, batches):
+        for score in self.predict_proba(batches):
+            yield to_labels(score, self.threshold)
+
+    def save(self, path: str) -> None:
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "BlendedEnsemble":
+        return joblib.load(path)
+
+@profiled
+def get_model_scores(
+    model,
+    splitter,
+    train_set,
+    test_set,
+    target: str,
+    n_folds: int,
+    plot_imp: bool = False,
+    n_jobs: int = 1,
+    threads_per_fold: int = None,
+    shared_matrix: bool = False,
+    return_ensemble: bool = False,
+    threshold: float = None,
+    plots: PlotQueue = None,
+    shared_data: tuple = None,
+    fold_callback=None,
+    sparse_missing: bool = False,
+):
+
+    options = dict(
+        plot_imp=plot_imp,
+        n_jobs=n_jobs,
+        threads_per_fold=threads_per_fold,
+        return_ensemble=return_ensemble,
+        threshold=threshold,
+        plots=plots,
+        fold_callback=fold_callback,
+        sparse_missing=sparse_missing,
+    )
+    # shared_data comes from share_training_data and is owned by the caller
+    if not shared_matrix or shared_data is not None:
+        return score_folds(model, splitter, train_set, test_set, target, n_folds, shared_data=shared_data, **options)
+
+    # the memory-mapped buffers go away even when a fold raises or a trial is pruned
+    directory = tempfile.mkdtemp(prefix="training_matrix_")
+    try:
+        shared_data = share_training_data(train_set, test_set, target, directory)
+        return score_folds(model, splitter, train_set, test_set, target, n_folds, shared_data=shared_data, **options)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def score_folds(
+    model,
+    splitter,
+    train_set,
+    test_set,
+    target: str,
+    n_folds: int,
+    plot_imp: bool = False,
+    n_jobs: int = 1,
+    threads_per_fold: int = None,
+    return_ensemble: bool = False,
+    threshold: float = None,
+    plots: PlotQueue = None,
+    shared_data: tuple = None,
+    fold_callback=None,
+    sparse_missing: bool = False,
+):
+
+    shared_matrix = shared_data is not None
+    if shared_matrix:
+        X, y, X_test = shared_data
+        X.prepare_model(model)
+        features = X.feature_names(model)
+    else:
+        y = train_set[target].copy()
+        X = train_set.drop(columns=[target], axis=1).copy()
+        features = X.columns
+        categories = {col: X[col].cat.categories for col in features if X[col].dtype.name == "category"}
+        X_test = to_model_input(model, test_set.drop(columns=[target], axis=1).copy(), sparse_missing)
+        X = to_model_input(model, X, sparse_missing)
     y_oof = np.zeros(X.shape[0])
     y_oof_score = np.zeros((X.shape[0], 2))
-    y_pred = np.zeros(X_test.shape[0])
-    y_score = np.zeros((X_test.shape[0], 2))
+    y_score = None if X_test is None else np.zeros((X_test.shape[0], 2))
 
-    scores = list()
-    for idx, (train_ind, val_ind) in enumerate(splitter.split(X, y)):
-        print(f"| Fold {idx+1} |".center(80, "-"))
-        X_train = X.iloc[train_ind]
-        y_train = y.iloc[train_ind]
-        X_val = X.iloc[val_ind]
-        y_val = y.iloc[val_ind]
-        print(f'train: {X_train.shape}')
-        print(f'val: {X_val.shape}')
-
-        #Training Classifier
-        model.fit(
-            X_train,
-            y_train,
-            eval_set=[(X_val, y_val)],
-            early_stopping_rounds=500,
-            verbose=250,
+    folds = list(splitter.split(X.values if shared_matrix else X, y))
+    if n_jobs == 1:
+        # the ensemble needs every fold model, not the last refit of the same object
+        results = (
+            fit_fold(clone_model(model) if return_ensemble else model, X, y, X_test, train_ind, val_ind, idx)
+            for idx, (train_ind, val_ind) in enumerate(folds)
         )
+    else:
+        n_workers = min(n_jobs if n_jobs > 0 else os.cpu_count(), len(folds))
+        threads_per_fold = threads_per_fold or max(os.cpu_count() // n_workers, 1)
+        # every fold trains its own clone, results come back in fold order
+        # worker processes do not record stages, the parallel folds are timed as one
+        with stage("folds", X):
+            results = Parallel(n_jobs=n_workers, backend="loky")(
+                delayed(fit_fold)(
+                    set_thread_budget(clone_model(model), threads_per_fold), X, y, X_test, train_ind, val_ind, idx
+                )
+                for idx, (train_ind, val_ind) in enumerate(folds)
+            )
 
-        #Feature Importances        
+    scores = list()
+    models = list()
+    for (train_ind, val_ind), (fold_model, val_score, test_score) in zip(folds, results):
+
+        #Feature Importances
         if plot_imp:
-            plot_importances(model, features)
+            title = "Feature Importances" if plots is None else f"{model.__class__.__name__} Fold {len(scores) + 1} Feature Importances"
+            plot_importances(fold_model, features, title, plots)
 
-        #Validation Predictions
-        val_pred = model.predict(X_val)
+        val_pred = to_labels(val_score, threshold)
         y_oof[val_ind] += val_pred
-
-        val_score = model.predict_proba(X_val)
         y_oof_score[val_ind] += val_score
+        if y_score is not None:
+            y_score += test_score / n_folds
 
-        #Test Predictions
-        test_pred = model.predict(X_test)
-        y_pred += test_pred / n_folds
-
-        test_score = model.predict_proba(X_test)
-        y_score += test_score / n_folds
-
-        print(f'fold accuracy: {accuracy_score(y_val, val_pred)}')
-        scores.append(accuracy_score(y_val, val_pred))
-        del X_train, y_train, X_val, y_val
-        gc.collect()
+        print(f'fold accuracy: {accuracy_score(y.iloc[val_ind], val_pred)}')
+        scores.append(accuracy_score(y.iloc[val_ind], val_pred))
+        if return_ensemble:
+            models.append(fold_model)
+        # may raise to stop the remaining folds, e.g. when a tuning trial is pruned
+        if fold_callback is not None:
+            fold_callback(len(scores) - 1, scores[-1])
 
     print('-'*80)
     print(f'accuracy: {accuracy_score(y, y_oof)}')
     cm = confusion_matrix(y, y_oof)
-    plot_confusion_matrix(cm, classes=[0,1], title=f'{model.__class__.__name__} Confusion Matrix', save=True)
+    plot_confusion_matrix(cm, classes=[0,1], title=f'{model.__class__.__name__} Confusion Matrix', save=True, plots=plots)
     print(f'folds avg accuracy: {np.mean(scores)}')
     print(f'folds std accuracy: {np.std(scores)}')
+    if return_ensemble:
+        ensemble = FoldEnsemble(models, X.columns, X.categories, True) if shared_matrix else FoldEnsemble(models, features, categories, sparse_missing=sparse_missing)
+
+    if return_ensemble:
+        return y_score, y_oof_score, ensemble
     
-    return y_score, y_oof_score
\ No newline at end of file
+    return y_score, y_oof_score
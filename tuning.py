@@ -0,0 +1,97 @@
+import io
+import os
+import shutil
+import tempfile
+import contextlib
+import numpy as np
+import optuna
+import pandas as pd
+from joblib import Parallel, delayed
+from utils import PlotQueue
+from train_models import get_model_scores, set_thread_budget, share_training_data
+
+def xgb_search_space(trial) -> dict:
+    return {
+        "max_depth": trial.suggest_int("max_depth", 6, 13),
+        "learning_rate": trial.suggest_float("learning_rate", 0.005, 0.05, log=True),
+        "subsample": trial.suggest_float("subsample", 0.6, 0.95),
+        "colsample_bytree": trial.suggest_float("colsample_bytree", 0.5, 1.0),
+        "min_child_weight": trial.suggest_float("min_child_weight", 1e-2, 10, log=True),
+    }
+
+def catboost_search_space(trial) -> dict:
+    return {
+        "depth": trial.suggest_int("depth", 6, 12),
+        "learning_rate": trial.suggest_float("learning_rate", 0.005, 0.05, log=True),
+        "one_hot_max_size": trial.suggest_int("one_hot_max_size", 2, 160),
+        "subsample": trial.suggest_float("subsample", 0.6, 0.95),
+        "l2_leaf_reg": trial.suggest_float("l2_leaf_reg", 1, 10, log=True),
+    }
+
+class PruningCallback:
+
+    def __init__(self, trial):
+        self.trial = trial
+        self.scores = list()
+
+    def __call__(self, fold: int, accuracy: float) -> None:
+
+        # the running mean keeps one lucky or unlucky fold from deciding alone
+        self.scores.append(accuracy)
+        self.trial.report(float(np.mean(self.scores)), fold)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned()
+
+def objective(trial, make_model, search_space, splitter, shared_data: tuple, n_folds: int, n_threads: int, directory: str) -> float:
+
+    model = set_thread_budget(make_model(search_space(trial)), n_threads)
+    callback = PruningCallback(trial)
+    with PlotQueue(directory) as plots, contextlib.redirect_stdout(io.StringIO()):
+        get_model_scores(
+            model, splitter, None, None, None, n_folds, plots=plots, shared_data=shared_data, fold_callback=callback
+        )
+
+    return float(np.mean(callback.scores))
+
+def run_trials(study_name: str, storage: str, n_trials: int, seed: int, pruner, *args) -> None:
+
+    # every worker opens the same study, trials and pruning statistics go through the storage
+    study = optuna.load_study(
+        study_name=study_name, storage=storage, sampler=optuna.samplers.TPESampler(seed=seed), pruner=pruner
+    )
+    study.optimize(lambda trial: objective(trial, *args), n_trials=n_trials)
+
+def tune(
+    make_model,
+    search_space,
+    train_set: pd.DataFrame,
+    target: str,
+    splitter,
+    n_folds: int,
+    n_trials: int = 50,
+    n_jobs: int = 1,
+    storage: str = "sqlite:///tuning.db",
+    study_name: str = "tuning",
+    seed: int = 42,
+    pruner=None,
+):
+
+    pruner = pruner or optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+    optuna.create_study(study_name=study_name, storage=storage, direction="maximize", load_if_exists=True)
+
+    n_workers = min(n_jobs if n_jobs > 0 else os.cpu_count(), n_trials)
+    n_threads = max(os.cpu_count() // n_workers, 1)
+    trials = [n_trials // n_workers + (i < n_trials % n_workers) for i in range(n_workers)]
+
+    # the feature matrix is written once and memory mapped by every trial in every worker
+    directory = tempfile.mkdtemp(prefix="tuning_")
+    try:
+        shared_data = share_training_data(train_set, None, target, directory)
+        args = (make_model, search_space, splitter, shared_data, n_folds, n_threads, directory)
+        Parallel(n_jobs=n_workers, backend="loky")(
+            delayed(run_trials)(study_name, storage, n, seed + i, pruner, *args) for i, n in enumerate(trials)
+        )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return optuna.load_study(study_name=study_name, storage=storage)
@@ -1,46 +1,261 @@
+import os
 import re
+import queue
 import itertools
+import threading
+import warnings
 import matplotlib
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.preprocessing import LabelEncoder, OrdinalEncoder
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from instrumentation import profiled, stage
+from data_profile import DataProfile, missing_table
+from text_normalization import my_tokenizer, normalize_series, translate_series, translation
 
-def my_tokenizer(text):
-    return re.split("\\s+",text)
+# the loaders and notebooks star-import utils, the text helpers stay reachable here after moving to text_normalization
+__all__ = ["my_tokenizer", "normalize_series", "translate_series", "translation"]
 
-def translation(x):
-    return x.translate(x.maketrans("ÜüÖöİıĞğŞşÇç", "UuOoIiGgSsCc"))
+COLUMNAR_FORMATS = {".parquet": "parquet", ".feather": "feather", ".arrow": "feather", ".ipc": "feather"}
+
+def table_format(path: str) -> str:
+    return COLUMNAR_FORMATS.get(os.path.splitext(path)[1].lower(), "csv")
+
+@profiled(name="read")
+def read_raw(path: str, columns: list = None) -> pd.DataFrame:
+
+    fmt = table_format(path)
+    if fmt == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    if fmt == "feather":
+        return pd.read_feather(path, columns=columns)
+
+    return pd.read_csv(path, usecols=columns)
+
+def iter_raw(path: str, columns: list = None, chunksize: int = 1_000_000):
+
+    # each chunk read is timed on its own, the consumer's work between chunks is not
+    chunks = read_chunks(path, columns, chunksize)
+    while True:
+        with stage("read") as current:
+            chunk = next(chunks, None)
+            current.rows(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+def read_chunks(path: str, columns: list = None, chunksize: int = 1_000_000):
+
+    fmt = table_format(path)
+    if fmt == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if fmt == "parquet":
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns)
+    else:
+        reader = pyarrow.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    for batch in batches:
+        df_ = batch.to_pandas()
+        yield df_ if columns is None else df_[columns]
+
+def convert_to_columnar(path: str, out_path: str = None, fmt: str = "parquet", block_size: int = 64 << 20) -> str:
+
+    import pyarrow.csv
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    out_path = out_path or f"{os.path.splitext(path)[0]}.{'parquet' if fmt == 'parquet' else 'feather'}"
+    reader = pyarrow.csv.open_csv(
+        path,
+        read_options=pyarrow.csv.ReadOptions(block_size=block_size),
+        # empty and NA-like strings become nulls, as with pd.read_csv
+        convert_options=pyarrow.csv.ConvertOptions(strings_can_be_null=True),
+    )
+    if fmt == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(out_path, reader.schema)
+    else:
+        writer = pyarrow.ipc.new_file(out_path, reader.schema)
+    with writer:
+        for batch in reader:
+            if fmt == "parquet":
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+
+    return out_path
+
+class PlotQueue:
+
+    def __init__(self, directory: str = "plots", ext: str = "jpg"):
+        self.directory = directory
+        self.ext = ext
+        self.data = dict()
+        self.errors = list()
+        self.reported = 0
+        self.tasks = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, draw, data, title: str) -> None:
+        self.data[title] = data
+        self.tasks.put((draw, data, title))
+
+    def run(self) -> None:
+
+        # pyplot is not thread safe, figures here are plain Agg figures that pyplot never tracks
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                break
+            draw, data, title = task
+            try:
+                fig = Figure()
+                FigureCanvasAgg(fig)
+                draw(fig, fig.add_subplot(), data, title)
+                os.makedirs(self.directory, exist_ok=True)
+                fig.savefig(os.path.join(self.directory, f"{title}.{self.ext}"), bbox_inches="tight")
+            except Exception as e:
+                self.errors.append((title, e))
+            finally:
+                self.tasks.task_done()
+
+    def join(self) -> None:
+        self.tasks.join()
+        self.report()
+
+    def close(self) -> None:
+        self.tasks.put(None)
+        self.worker.join()
+        self.report()
+
+    def report(self) -> None:
+
+        # a warning rather than an exception, close also runs while another exception unwinds
+        failed = self.errors[self.reported:]
+        self.reported = len(self.errors)
+        if failed:
+            details = "; ".join(f"{title}: {error!r}" for title, error in failed)
+            warnings.warn(f"{len(failed)} plot(s) could not be saved: {details}", RuntimeWarning)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def draw_confusion_matrix(fig, ax, cm: pd.DataFrame, title: str) -> None:
+
+    im = ax.imshow(cm.values, interpolation='nearest', cmap='Greens')
+    ax.set_title(title, size = 12)
+    fig.colorbar(im, ax=ax)
+    tick_marks = np.arange(len(cm.columns))
+    ax.set_xticks(tick_marks)
+    ax.set_xticklabels(cm.columns, rotation=45)
+    ax.set_yticks(tick_marks)
+    ax.set_yticklabels(cm.index)
+    thresh = cm.values.max() / 2.
+    for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
+        ax.text(j, i, format(cm.values[i, j], '.0f'),
+                horizontalalignment="center",
+                color="white" if cm.values[i, j] > thresh else "black")
+    ax.set_ylabel('True label')
+    ax.set_xlabel('Predicted label')
+    ax.grid(False)
+    fig.tight_layout()
 
 def plot_confusion_matrix(cm,
                           classes,
                           title,
-                          save:bool=False):
-
-    plt.imshow(cm, interpolation='nearest', cmap='Greens')
-    plt.title(title, size = 12)
-    plt.colorbar()
-    tick_marks = np.arange(len(classes))
-    plt.xticks(tick_marks, classes, rotation=45)
-    plt.yticks(tick_marks, classes)
-    thresh = cm.max() / 2.
-    for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
-        plt.text(j, i, format(cm[i, j], '.0f'),
-                 horizontalalignment="center",
-                 color="white" if cm[i, j] > thresh else "black")
-    plt.tight_layout()
-    plt.ylabel('True label')
-    plt.xlabel('Predicted label')
-    plt.grid(False)
+                          save:bool=False,
+                          plots: PlotQueue = None) -> pd.DataFrame:
+
+    cm = pd.DataFrame(cm, index=classes, columns=classes)
+    if plots is not None:
+        plots.submit(draw_confusion_matrix, cm, title)
+        return cm
+
+    fig, ax = plt.subplots()
+    draw_confusion_matrix(fig, ax, cm, title)
     if save:
         plt.savefig(f'plots/{title}.jpg')
     plt.show()
+    plt.close(fig)
+
+    return cm
 
 def load_tr_cities() -> list:
 
     return ['ISTANBUL', 'BALIKESIR', 'BURSA', 'TEKIRDAG', 'CANAKKALE', 'YALOVA', 'KOCAELI', 'KIRKLARELI', 'EDIRNE', 'BILECIK', 'SAKARYA', 'IZMIR', 'MANISA', 'AYDIN', 'DENIZLI', 'USAK', 'AFYONKARAHISAR', 'KUTAHYA', 'MUGLA', 'ANTALYA', 'ADANA', 'MERSIN', 'HATAY', 'BURDUR', 'OSMANIYE', 'KAHRAMANMARAS', 'ISPARTA', 'ANKARA', 'KONYA', 'KAYSERI', 'ESKISEHIR', 'SIVAS', 'KIRIKKALE', 'AKSARAY', 'KARAMAN', 'KIRSEHIR', 'NIGDE', 'NEVSEHIR', 'YOZGAT', 'CANKIRI', 'AMASYA', 'ARTVIN', 'BARTIN', 'BAYBURT', 'BOLU', 'CORUM', 'DUZCE', 'GUMUSHANE', 'GIRESUN', 'KARABUK', 'KASTAMONU', 'ORDU', 'RIZE', 'SAMSUN', 'SINOP', 'TOKAT', 'TRABZON', 'ZONGULDAK', 'AGRI', 'ARDAHAN', 'BITLIS', 'BINGOL', 'ELAZIG', 'ERZINCAN', 'ERZURUM', 'HAKKARI', 'IGDIR', 'KARS', 'MALATYA', 'MUS', 'TUNCELI', 'VAN', 'GAZIANTEP', 'DIYARBAKIR', 'SANLIURFA', 'BATMAN', 'ADIYAMAN', 'SIIRT', 'MARDIN', 'KILIS', 'SIRNAK']
 
+class LocationNormalizer:
+
+    special_cases = [
+        ("Kahraman Maras", "Kahramanmaras, Turkey"),
+        ("Şanliurfa", "Sanliurfa, Turkey"),
+        ("İçel", "Mersin, Turkey"),
+        ("Afyon", "Afyonkarahisar, Turkey"),
+    ]
+
+    def __init__(self, cities: list = None):
+
+        self.cities = load_tr_cities() if cities is None else cities
+        self.rank = {city: i for i, city in enumerate(self.cities)}
+        # lookahead alternation reports, at every position, the earliest listed city starting there
+        self.matcher = re.compile("(?=(" + "|".join(map(re.escape, self.cities)) + "))")
+        # a matched city is itself checked against the cities listed after it (e.g. GUMUSHANE -> MUS)
+        self.resolved = dict()
+        for i, city in enumerate(self.cities):
+            result = city
+            for other in self.cities[i + 1:]:
+                if other in result:
+                    result = other
+            self.resolved[city] = result
+        self.cache = dict()
+
+    def normalize_one(self, x) -> str:
+
+        x = str(x)
+        for pattern, replacement in self.special_cases:
+            if pattern in x:
+                x = replacement
+                break
+        x = translation(x.replace("Türkiye", "Turkey").upper().strip())
+        ranks = [self.rank[m.group(1)] for m in self.matcher.finditer(x)]
+
+        return self.resolved[self.cities[min(ranks)]] if ranks else x
+
+    @profiled(name="normalize_location")
+    def normalize(self, series: pd.Series) -> pd.Series:
+
+        uniques = series.unique()
+        # NaN never equals itself, nulls are keyed by their text, which is also what normalize_one sees
+        keys = [str(x) if pd.isnull(x) else x for x in uniques]
+        for x, key in zip(uniques, keys):
+            if key not in self.cache:
+                self.cache[key] = self.normalize_one(x)
+
+        return series.map(pd.Series([self.cache[key] for key in keys], index=uniques))
+
+location_normalizer = LocationNormalizer()
+
+@profiled
+def fix_location(dataframe: pd.DataFrame, feature: str = "location") -> pd.DataFrame:
+
+    tr_cities = load_tr_cities()
+    df_ = dataframe.copy()
+    df_[feature] = location_normalizer.normalize(df_[feature])
+    df_[f"{feature}_based_on_tr"] = df_[feature].isin(tr_cities + ["TURKEY"]).astype(int)
+
+    return df_
+
 def desc_stats(dataframe: pd.DataFrame, title=None) -> None:
 
     desc = dataframe.describe().T
@@ -61,12 +276,13 @@ def desc_stats(dataframe: pd.DataFrame, title=None) -> None:
     plt.title("Descriptive Statistics" if title == None else title, size=12)
     plt.show()
 
-def corr_map(dataframe: pd.DataFrame, method="pearson", title=None) -> None:
+def corr_map(dataframe, method="pearson", title=None) -> pd.DataFrame:
     assert method in ["pearson", "spearman"], "Invalid Correlation Method"
-    matrix = np.triu(dataframe.corr(method=method))
+    corr = dataframe.corr(method=method)
+    matrix = np.triu(corr)
     f, ax = plt.subplots(figsize=(matrix.shape[0] * 0.55, matrix.shape[1] * 0.55))
     sns.heatmap(
-        dataframe.corr(method=method),
+        corr,
         annot=True,
         fmt=".2f",
         cbar=False,
@@ -84,35 +300,50 @@ def corr_map(dataframe: pd.DataFrame, method="pearson", title=None) -> None:
     plt.title(f"{method.title()} Correlation Map" if title == None else title, size=14)
     plt.show()
 
-def plot_importances(model, features):
-    sns.set(rc={"axes.facecolor": "gainsboro", "figure.facecolor": "gainsboro"})
+    return corr
+
+def draw_importances(fig, ax, importances: pd.Series, title: str) -> None:
+    fig.set_size_inches(20, 10)
+    fig.set_facecolor("gainsboro")
+    ax.set_facecolor("gainsboro")
+    ax.set_title(title, size=10)
+    ax.barh(
+        range(len(importances)), importances.values, color="royalblue", align="center"
+    )
+    ax.set_yticks(range(len(importances)))
+    ax.set_yticklabels(importances.index)
+    ax.set_xlabel("Relative Importance", size=10)
+
+def plot_importances(model, features, title: str = "Feature Importances", plots: PlotQueue = None) -> pd.Series:
     importances = model.feature_importances_
     indices = np.argsort(importances)
     indices = indices[-50:]
-    plt.figure(figsize=(20, 10))
-    plt.title("Feature Importances", size=10)
-    plt.barh(
-        range(len(indices)), importances[indices], color="royalblue", align="center"
-    )
-    plt.yticks(range(len(indices)), [features[i] for i in indices])
-    plt.xlabel("Relative Importance", size=10)
+    importances = pd.Series(importances[indices], index=[features[i] for i in indices])
+    if plots is not None:
+        plots.submit(draw_importances, importances, title)
+        return importances
+
+    sns.set(rc={"axes.facecolor": "gainsboro", "figure.facecolor": "gainsboro"})
+    fig, ax = plt.subplots()
+    draw_importances(fig, ax, importances, title)
     plt.show()
+    plt.close(fig)
     matplotlib.rc_file_defaults()
     sns.reset_orig()
 
+    return importances
 
-def check_missing(dataframe: pd.DataFrame) -> pd.DataFrame:
 
-    return pd.DataFrame(
-        {
-            "feature": dataframe.columns,
-            "n_missing": [dataframe[i].isnull().sum() for i in dataframe.columns],
-            "missing_ratio": [dataframe[i].isnull().sum() / dataframe.shape[0] for i in dataframe.columns],
-        }
-    ).reset_index(drop=True).sort_values("n_missing", ascending=False)
+def check_missing(dataframe) -> pd.DataFrame:
 
+    # a DataProfile already holds the null counts
+    if isinstance(dataframe, DataProfile):
+        return dataframe.missing()
 
-def plot_missing(dataframe: pd.DataFrame, title=None):
+    return missing_table(dataframe.isnull().sum(), dataframe.shape[0])
+
+
+def plot_missing(dataframe, title=None):
     sns.set(rc={"axes.facecolor": "gainsboro", "figure.facecolor": "gainsboro"})
     plt.figure(figsize=(12, 6))
     sns.barplot(
@@ -212,15 +443,9 @@ population = {
     "Tunceli": 83645,
 }
 
+@profiled
 def add_populations(dataframe: pd.DataFrame) -> pd.DataFrame:
-
-    df_ = dataframe.copy()
-    new_pops = pd.DataFrame()
-    for k in population.keys():
-        new_pops = new_pops.append(pd.DataFrame({'location': [translation(k.upper())], 'population': [population[k]]}))
-
-    df_ = df_.merge(new_pops, on = ['location'], how = 'left')
-    return df_
+    return add_reference_data(dataframe, ["population"])
 
 employment = {
 'ADANA': 37816,
@@ -305,42 +530,140 @@ employment = {
 'YOZGAT': 5405,
 'ZONGULDAK': 5420}
 
+@profiled
 def add_employment(dataframe: pd.DataFrame) -> pd.DataFrame:
+    return add_reference_data(dataframe, ["iskur_employment_2019"])
 
-    df_ = dataframe.copy()
-    new_emp = pd.DataFrame()
-    for k in employment.keys():
-        new_emp = new_emp.append(pd.DataFrame({'location': [translation(k.upper())], 'iskur_employment_2019': [employment[k]]}))
+reference_tables = dict()
+
+def register_reference(column: str, table: dict) -> None:
+
+    # province names are keyed the way location_normalizer writes them
+    lookup = pd.Series(table)
+    lookup.index = [translation(k.upper()) for k in lookup.index]
+    assert lookup.index.is_unique, f"Duplicate provinces in {column}"
+    reference_tables[column] = lookup
+
+def add_reference_data(dataframe: pd.DataFrame, columns: list = None, on: str = "location") -> pd.DataFrame:
+
+    # shallow copy, the caller's columns are shared rather than copied
+    df_ = dataframe.copy(deep=False)
+    # a categorical location, e.g. after compact_dtypes, would map to a categorical column
+    locations = df_[on].astype(object)
+    for column in reference_tables.keys() if columns is None else columns:
+        df_[column] = locations.map(reference_tables[column])
 
-    df_ = df_.merge(new_emp, on = ['location'], how = 'left')
     return df_
 
+register_reference("population", population)
+register_reference("iskur_employment_2019", employment)
+
+
+def downcast_integers(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series, downcast="unsigned" if series.min() >= 0 else "integer")
+
+def fits_float32(series: pd.Series, rtol: float) -> bool:
+
+    values = series.dropna().values
+    if values.size == 0:
+        return True
+    if np.abs(values).max() > np.finfo(np.float32).max:
+        return False
+    error = np.abs(values.astype(np.float32).astype(np.float64) - values)
+    # integer valued columns (counts, ids, years after a left merge) have to round trip exactly
+    if (values == np.round(values)).all():
+        return bool((error == 0).all())
+
+    return bool((error <= rtol * np.abs(values)).all())
+
+def memory_saved(name: str, before: int, after: int) -> str:
+    return f"{name}: {before / 2 ** 20:.2f} MB -> {after / 2 ** 20:.2f} MB ({1 - after / max(before, 1):.1%} saved)"
+
+def compact_dtypes(
+    dataframe: pd.DataFrame,
+    exclude: list = ["user_id"],
+    float32: bool = True,
+    rtol: float = 1e-6,
+    verbose: bool = True,
+    name: str = "memory",
+) -> pd.DataFrame:
+
+    # counts go to the smallest integer type, floats to float32 within rtol, strings to categoricals
+    before = dataframe.memory_usage(index=False, deep=True).sum()
+    columns = dict()
+    for col in dataframe.columns.drop(exclude, errors="ignore"):
+        series = dataframe[col]
+        if isinstance(series.dtype, pd.SparseDtype) or pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series) and series.size:
+            columns[col] = downcast_integers(series)
+        elif pd.api.types.is_float_dtype(series) and series.dtype != np.float32 and float32 and fits_float32(series, rtol):
+            columns[col] = series.astype(np.float32)
+        elif pd.api.types.is_object_dtype(series):
+            columns[col] = series.astype("category")
+
+    dataframe = dataframe.assign(**columns) if columns else dataframe
+    if verbose:
+        print(memory_saved(name, before, dataframe.memory_usage(index=False, deep=True).sum()))
+
+    return dataframe
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+
+    report = pd.DataFrame(
+        {
+            "dtype_before": before.dtypes.astype(str),
+            "dtype_after": after.dtypes.reindex(before.columns).astype(str),
+            "mb_before": before.memory_usage(index=False, deep=True) / 2 ** 20,
+            "mb_after": after.memory_usage(index=False, deep=True).reindex(before.columns) / 2 ** 20,
+        }
+    )
+
+    return report.assign(mb_saved=report.mb_before - report.mb_after).sort_values("mb_saved", ascending=False)
+
+def shared_categories(*columns: pd.Series) -> pd.Index:
+
+    categories = pd.Index(pd.concat([pd.Series(col.dropna().unique()) for col in columns]).unique())
+    try:
+        return categories.sort_values()
+    except TypeError:
+        return categories
+
+def encode_categories(columns: list, *frames: pd.DataFrame) -> None:
+
+    # one category list per column for every frame, so train and test share the same codes;
+    # columns are replaced in place instead of copying the frames
+    for col in columns:
+        categories = shared_categories(*[frame[col] for frame in frames])
+        for frame in frames:
+            frame[col] = pd.Categorical(frame[col], categories=categories)
 
 def label_encode(
     le_cols: list, train_data: pd.DataFrame, test_data: pd.DataFrame = pd.DataFrame(), fillna: bool = False
 ):
-    train_ = train_data.copy()
-    test_ = test_data.copy()
-    if test_.shape[0] == 0:
-        for col in le_cols:
-            encoder = LabelEncoder()
-            train_[col] = encoder.fit_transform(train_[col])
+    # codes follow the sorted train categories like the sklearn encoders, only the encoded columns are replaced
+    if test_data.shape[0] == 0:
+        codes = {
+            col: pd.Categorical(train_data[col], categories=shared_categories(train_data[col])).codes.astype(np.int64)
+            for col in le_cols
+        }
 
-        return train_
+        return train_data.assign(**codes)
     else:
+        train_codes, test_codes = dict(), dict()
         for col in le_cols:
-            encoder = OrdinalEncoder(
-                handle_unknown="use_encoded_value", unknown_value=np.nan
-            )
-            train_[col] = encoder.fit_transform(train_[col].values.reshape(-1, 1))
-            test_[col] = encoder.transform(test_[col].values.reshape(-1, 1))
-            if fillna and test_[col].isnull().sum() != 0:
-                max_ = max(
-                    train_[col].dropna().astype(int).max(),
-                    test_[col].dropna().astype(int).max(),
-                )
-                test_[col] = test_[col].fillna(max_ + 1)
-                train_[col] = train_[col].fillna(max_ + 1)
-
-        return train_, test_
-        
+            # missing and unseen values are NaN, like OrdinalEncoder with unknown_value=np.nan
+            categories = shared_categories(train_data[col])
+            train_codes[col] = pd.Series(pd.Categorical(train_data[col], categories=categories).codes, index=train_data.index).astype(float)
+            train_codes[col] = train_codes[col].mask(train_codes[col] == -1, np.nan)
+            test_codes[col] = pd.Series(pd.Categorical(test_data[col], categories=categories).codes, index=test_data.index).astype(float)
+            test_codes[col] = test_codes[col].mask(test_codes[col] == -1, np.nan)
+            if fillna and test_codes[col].isnull().sum() != 0:
+                max_ = max(train_codes[col].max(), test_codes[col].max())
+                test_codes[col] = test_codes[col].fillna(max_ + 1)
+                train_codes[col] = train_codes[col].fillna(max_ + 1)
+
+        return train_data.assign(**train_codes), test_data.assign(**test_codes)
+
+# every other public name is exported as well, like a module without __all__
+__all__ += [name for name in list(globals()) if not name.startswith("_") and name not in __all__]